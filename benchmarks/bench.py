@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the receive, collect and extract hot paths in practable.core
+
+Each case runs in a fresh process, against a synthetic stream of frames made
+by practable.emulator.Telemetry that is fed straight into Experiment.recv,
+so no network or booking server is needed, and the results measure the
+client rather than the link. For each case this reports messages/sec, the
+p50 and p99 time taken to get each message within the method measured
+(collect_count, collect_duration or stream), and the peak RSS.
+
+    python benchmarks/bench.py                       # run all cases
+    python benchmarks/bench.py -k collect_count      # cases matching a name
+    python benchmarks/bench.py --save baseline.json  # save a baseline
+    python benchmarks/bench.py --compare baseline.json
+
+--compare exits with status 1 if any case is slower than the baseline by
+more than --threshold (default 10%).
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the extract_series and to_arrays cases
+    np = None
+
+from practable.core import Experiment, printProgressBar
+from practable.emulator import Spinner, Telemetry
+
+MESSAGES = 100000
+
+# (case name, benchmark, telemetry arguments)
+CASES = [
+    ("collect_count/lines=1", "collect_count", {}),
+    ("collect_count/lines=10", "collect_count", {
+        "lines_per_frame": 10
+    }),
+    ("collect_count/lines=100", "collect_count", {
+        "lines_per_frame": 100
+    }),
+    ("collect_count/padding=1000", "collect_count", {
+        "lines_per_frame": 10,
+        "padding": 1000
+    }),
+    ("collect_count/nesting=3", "collect_count", {
+        "lines_per_frame": 10,
+        "nesting": 3
+    }),
+    ("collect_duration/rate=100", "collect_duration", {
+        "rate": 100,
+        "lines_per_frame": 10
+    }),
+    ("collect_duration/rate=1000", "collect_duration", {
+        "rate": 1000,
+        "lines_per_frame": 10
+    }),
+    ("collect_duration/samples=10", "collect_duration", {
+        "rate": 1000,
+        "lines_per_frame": 10,
+        "samples_per_message": 10
+    }),
+    ("stream/lines=10", "stream", {
+        "lines_per_frame": 10
+    }),
+    ("extract_series/samples=10", "extract_series", {
+        "lines_per_frame": 10,
+        "samples_per_message": 10
+    }),
+    ("to_arrays/samples=10", "to_arrays", {
+        "lines_per_frame": 10,
+        "samples_per_message": 10
+    }),
+    ("printProgressBar", "printProgressBar", {}),
+]
+
+
+class SyntheticExperiment(Experiment):
+    # an Experiment that receives pre-generated frames, with no booking
+
+    def __init__(self, frames, **kwargs):
+        super().__init__("", "synthetic", **kwargs)
+        self.frames = iter(frames)
+
+    def make_booker(self, book_server, config_in_cwd):
+        return None
+
+    def recv(self, timeout=None):
+        try:
+            return next(self.frames)
+        except StopIteration:
+            raise EOFError("end of synthetic stream")
+
+
+def make_frames(telemetry, messages):
+    frames = []
+    count = 0
+    for wait, frame in telemetry.frames(Spinner()):
+        frames.append(frame)
+        count += telemetry.lines_per_frame
+        if count >= messages:
+            return frames
+
+
+def peak_rss():
+    # in bytes, or None if not known
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run_case(bench, options, messages):
+    # runs in its own process, so that peak RSS is for this case only
+    telemetry = Telemetry(**options)
+    frames = make_frames(telemetry, messages)
+    expt = SyntheticExperiment(frames, time_key=telemetry.time_key)
+    latencies = []
+
+    if bench == "printProgressBar":
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for i in range(messages):
+                t = time.perf_counter_ns()
+                printProgressBar(i, messages, length=50)
+                latencies.append(time.perf_counter_ns() - t)
+            elapsed = time.perf_counter() - start
+        count = messages
+
+    elif bench in ("extract_series", "to_arrays"):
+        collected = expt.collect_count(messages, verbose=False)
+        keys = ["t", "d", "c"]
+        start = time.perf_counter()
+        if bench == "to_arrays":
+            expt.to_arrays(collected, keys)
+        else:
+            # the same result as to_arrays, so the two can be compared
+            for key in keys:
+                np.asarray(expt.extract_series(collected, key))
+        elapsed = time.perf_counter() - start
+        count = len(collected)
+
+    else:
+        # time each message from the one before, within the method measured
+        next_message = expt.next_message
+        last = [time.perf_counter_ns()]
+
+        def timed_next_message(timeout=None):
+            message = next_message(timeout=timeout)
+            now = time.perf_counter_ns()
+            latencies.append(now - last[0])
+            last[0] = now
+            return message
+
+        expt.next_message = timed_next_message
+
+        start = time.perf_counter()
+        last[0] = time.perf_counter_ns()
+        if bench == "collect_count":
+            count = len(expt.collect_count(messages, verbose=False))
+        elif bench == "collect_duration":
+            # long enough in message time to use all the frames
+            count = len(
+                expt.collect_duration(messages / telemetry.rate,
+                                      verbose=False))
+        else:
+            count = 0
+            for message in expt.stream(count=messages).map(lambda m: m):
+                count += 1
+        elapsed = time.perf_counter() - start
+
+    return {
+        "messages": count,
+        "messages_per_sec": count / elapsed,
+        "p50_us": None if len(latencies) == 0 else percentile(latencies, 50) / 1000,
+        "p99_us": None if len(latencies) == 0 else percentile(latencies, 99) / 1000,
+        "peak_rss_mb": None if peak_rss() is None else peak_rss() / 1e6,
+    }
+
+
+def compare(results, baseline, threshold):
+    # returns the names of cases that are slower than the baseline
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["messages_per_sec"]
+        after = result["messages_per_sec"]
+        change = (after - before) / before
+        flag = ""
+        if change < -threshold:
+            slower.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:36s} {before:14.0f} -> {after:14.0f} {change:+8.1%}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-k", default="", help="only run cases containing this")
+    parser.add_argument("--messages", type=int, default=MESSAGES)
+    parser.add_argument("--save", help="save results as a baseline")
+    parser.add_argument("--compare", help="compare results with a baseline")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        bench, options = json.loads(args.run_case)
+        print(json.dumps(run_case(bench, options, args.messages)))
+        return
+
+    results = {}
+    print(f"{'case':36s} {'msg/s':>14s} {'p50 us':>8s} {'p99 us':>8s} {'RSS MB':>8s}")
+
+    for name, bench, options in CASES:
+        if args.k not in name:
+            continue
+        out = subprocess.run([
+            sys.executable, __file__, "--messages",
+            str(args.messages), "--run-case",
+            json.dumps([bench, options])
+        ],
+                             check=True,
+                             stdout=subprocess.PIPE,
+                             text=True).stdout
+        r = json.loads(out.splitlines()[-1])
+        results[name] = r
+        p50 = "" if r["p50_us"] is None else "%8.2f" % (r["p50_us"])
+        p99 = "" if r["p99_us"] is None else "%8.2f" % (r["p99_us"])
+        rss = "" if r["peak_rss_mb"] is None else "%8.1f" % (r["peak_rss_mb"])
+        print(f"{name:36s} {r['messages_per_sec']:14.0f} {p50:>8s} {p99:>8s} {rss:>8s}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(
+                {
+                    "python": sys.version,
+                    "platform": sys.platform,
+                    "results": results,
+                },
+                file,
+                indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        print()
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,11 +25,11 @@ with Experiment('g-open-x3fca8','Spinner 51 (Open Days)', exact=True) as expt:
     messages = expt.collect(1.5)
     
     # Process the data
-    ts = expt.extract_series(messages, "t")
-    ds = expt.extract_series(messages, "d")
-    cs = expt.extract_series(messages, "c")
+    data = expt.to_arrays(messages, ["t", "d", "c"])
+    ds = data["d"]
+    cs = data["c"]
     
-    t = np.array(ts)
+    t = data["t"]
     t = t - t[0]
     
     # Plot the data
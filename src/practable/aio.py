@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AsyncBooker and AsyncExperiment let one asyncio event loop drive many
+experiments at once, e.g.
+
+    async def run(name):
+        async with AsyncExperiment('g-open-x3fca8', name, exact=True) as expt:
+            await expt.command('{"set":"mode","to":"stop"}')
+            return await expt.collect(1.5)
+
+    async def main():
+        return await asyncio.gather(*[run(n) for n in names])
+
+    results = asyncio.run(main())
+
+The websocket streams use the asyncio websockets client. The booking server
+calls are few per experiment and use the same requests-based Booker as the
+blocking API, so they are run in the event loop's default executor rather
+than blocking the loop.
+
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import functools
+
+try:
+    from websockets.asyncio.client import connect as wsconnect
+except ImportError:  # websockets < 13
+    from websockets.client import connect as wsconnect
+from websockets.exceptions import ConnectionClosed
+
+from practable.buffer import MessageBuffer
+from practable.command import RateLimiter
+from practable.decode import Decoder
+from practable.core import CLOCK_MARGIN, Booker, DurationClock, Experiment, printProgressBar
+
+
+class AsyncBooker:
+    # wraps a blocking Booker so that each call is awaitable; the Booker's
+    # state (bookings, activities etc) is available as self.booker
+
+    def __init__(self, booker):
+        self.booker = booker
+
+    @classmethod
+    async def create(cls,
+                     book_server="https://app.practable.io/ed0/book",
+                     config_in_cwd=False):
+        # Booker logs in when initialised, so create it off the event loop
+        booker = await _run(Booker,
+                            book_server=book_server,
+                            config_in_cwd=config_in_cwd)
+        return cls(booker)
+
+    def __str__(self):
+        return str(self.booker)
+
+    async def add_group(self, group):
+        return await _run(self.booker.add_group, group)
+
+    async def book(self, duration, selected=""):
+        return await _run(self.booker.book, duration, selected=selected)
+
+    async def book_soonest(self, duration, max_wait=None):
+        return await _run(self.booker.book_soonest,
+                          duration,
+                          max_wait=max_wait)
+
+    async def close(self):
+        return await _run(self.booker.close)
+
+    async def cancel_booking(self, name):
+        return await _run(self.booker.cancel_booking, name)
+
+    async def cancel_all_bookings(self):
+        return await _run(self.booker.cancel_all_bookings)
+
+    async def check_slot_available(self, slot):
+        return await _run(self.booker.check_slot_available, slot)
+
+    async def ensure_logged_in(self):
+        return await _run(self.booker.ensure_logged_in)
+
+    async def set_user(self, user):
+        return await _run(self.booker.set_user, user)
+
+    async def filter_experiments(self,
+                                 sub,
+                                 number="",
+                                 exact=False,
+                                 workers=8,
+                                 first=None,
+                                 match="substring",
+                                 group=None):
+        return await _run(self.booker.filter_experiments,
+                          sub,
+                          number=number,
+                          exact=exact,
+                          workers=workers,
+                          first=first,
+                          match=match,
+                          group=group)
+
+    async def get_activity(self, booking, refresh=False):
+        return await _run(self.booker.get_activity, booking, refresh=refresh)
+
+    async def get_all_activities(self, names=None, workers=8):
+        return await _run(self.booker.get_all_activities,
+                          names=names,
+                          workers=workers)
+
+    async def get_bookings(self):
+        return await _run(self.booker.get_bookings)
+
+    async def get_group_details(self, refresh=False):
+        return await _run(self.booker.get_group_details, refresh=refresh)
+
+    async def connect(self, name, which="data"):
+        return await _run(self.booker.connect, name, which=which)
+
+
+class AsyncExperiment:
+    # asyncio counterpart of Experiment, with its booking, time, buffer,
+    # decoder and command arguments, and its methods, except that methods
+    # which talk to the experiment must be awaited
+    # verbose defaults to False because progress bars from many experiments
+    # sharing one terminal would overwrite each other
+
+    def __init__(self,
+                 group,
+                 name,
+                 user="",
+                 book_server="",
+                 config_in_cwd=False,
+                 duration=timedelta(minutes=3),
+                 exact=False,
+                 number="",
+                 time_format="ms",
+                 time_key="t",
+                 key_separator="/",
+                 cancel_new_booking_on_exit=True,
+                 max_wait_to_start=timedelta(minutes=1),
+                 buffer_capacity=100000,
+                 buffer_overflow="drop-oldest",
+                 decoder="auto",
+                 queue=False,
+                 command_rate=20,
+                 command_burst=1):
+
+        self.book_server = book_server
+        self.booker = None
+        self.command_limiter = RateLimiter(rate=command_rate,
+                                           burst=command_burst)
+        self.config_in_cwd = config_in_cwd
+        if isinstance(decoder, Decoder):
+            self.decoder = decoder
+        else:
+            self.decoder = Decoder(decoder)
+        self.duration = duration
+        self.exact = exact
+        self.group = group
+        self.key_separator = key_separator
+        self.max_wait_to_start = max_wait_to_start
+        self.name = name
+        self.number = number
+        self.queue = queue
+        self.stashed_messages = MessageBuffer(capacity=buffer_capacity,
+                                              overflow=buffer_overflow)
+        self.time_format = time_format
+        self.time_key = time_key
+        self.user = user
+        self.cancel_new_booking_on_exit = cancel_new_booking_on_exit
+
+    async def __aenter__(self):
+        if self.book_server == "":
+            self.booker = await AsyncBooker.create(
+                config_in_cwd=self.config_in_cwd)
+        else:
+            self.booker = await AsyncBooker.create(
+                book_server=self.book_server,
+                config_in_cwd=self.config_in_cwd)
+
+        if self.user != "":
+            await self.booker.set_user(self.user)
+
+        await self.booker.add_group(self.group)
+        # the group details give the experiment's slot, so only the activity
+        # for its booking needs to be fetched
+        await self.booker.get_group_details()
+        # see if we have an existing booking
+        await self.booker.get_bookings()
+        await self.booker.get_all_activities(names=[self.name])
+
+        try:
+            self.url = await self.booker.connect(self.name)
+            self.cancel_booking_on_exit = False
+        except KeyError:
+            # make a booking
+            await self.booker.filter_experiments(self.name, self.number,
+                                                 self.exact)
+            if self.queue:
+                self.name, start = await self.booker.book_soonest(
+                    self.duration, max_wait=self.max_wait_to_start)
+                wait = (start - datetime.now(timezone.utc)).total_seconds()
+                if wait > 0:
+                    await asyncio.sleep(wait + CLOCK_MARGIN)
+            else:
+                self.name = await self.booker.book(self.duration)
+            await self.booker.get_bookings()
+            await self.booker.get_all_activities(names=[self.name])
+            self.url = await self.booker.connect(self.name)
+            self.cancel_booking_on_exit = self.cancel_new_booking_on_exit
+
+        # https://websockets.readthedocs.io/en/stable/reference/asyncio/client.html
+        self.websocket = await wsconnect(self.url)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.websocket.close()
+        if self.cancel_booking_on_exit:
+            #identify and cancel booking
+            booking = self.booker.booker.activities[self.name]["booking"]
+            await self.booker.cancel_booking(booking)
+        await self.booker.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # iterate over decoded messages until the stream closes, e.g.
+        # async for message in expt: ...
+        while True:
+            try:
+                return self.stashed_messages.popleft()
+            except IndexError:
+                pass
+            try:
+                message = await self.recv()
+            except ConnectionClosed:
+                raise StopAsyncIteration
+            self.stashed_messages.extend(self.decode(message), block=False)
+
+    # these do not talk to the experiment, so are shared with Experiment
+    decode = Experiment.decode
+    extract = Experiment.extract
+    extract_series = Experiment.extract_series
+    message_time = Experiment.message_time
+    to_arrays = Experiment.to_arrays
+
+    async def collect_count(self, count, timeout=None, verbose=False):
+        messages = []
+
+        while len(messages) < count:
+            if len(self.stashed_messages) == 0:
+                message = await self.recv(timeout=timeout)
+                self.stashed_messages.extend(self.decode(message),
+                                             block=False)
+
+            while len(messages) < count and len(self.stashed_messages) > 0:
+                messages.append(self.stashed_messages.popleft())
+
+            if verbose:
+                printProgressBar(len(messages),
+                                 count,
+                                 prefix=f'Collecting {count} messages',
+                                 suffix='Complete',
+                                 length=50)
+
+        if verbose:
+            print(end="\n")
+
+        return messages
+
+    async def command(self, message, verbose=False):
+        if verbose:
+            print("Command: " + message)
+        await self.send(message)
+
+    async def recv(self, timeout=None):
+        # match the blocking client, which raises TimeoutError
+        if timeout is not None and timeout <= 0:
+            # before Python 3.12, wait_for gives up at once with a timeout of
+            # 0, even if a message has already arrived, so allow a moment
+            timeout = 0.001
+        try:
+            return await asyncio.wait_for(self.websocket.recv(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("timed out waiting for message")
+
+    async def send(self, message):
+        # rate limited to ensure messages are separate, see RateLimiter
+        wait = self.command_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.websocket.send(message)
+
+    async def ignore(self,
+                     duration_seconds,
+                     timeout=None,
+                     verbose=False,
+                     stop_on="message"):
+        return await self.collect_duration(duration_seconds,
+                                           timeout=timeout,
+                                           verbose=verbose,
+                                           ignore=True,
+                                           stop_on=stop_on)
+
+    async def collect(self,
+                      duration_seconds,
+                      timeout=None,
+                      verbose=False,
+                      stop_on="message"):
+        return await self.collect_duration(duration_seconds,
+                                           timeout=timeout,
+                                           verbose=verbose,
+                                           ignore=False,
+                                           stop_on=stop_on)
+
+    async def collect_duration(self,
+                               duration_seconds,
+                               timeout=None,
+                               verbose=False,
+                               ignore=False,
+                               stop_on="message"):
+        # see DurationClock for how the two clocks are used
+        clock = DurationClock(duration_seconds,
+                              self.message_time,
+                              stop_on=stop_on,
+                              time_format=self.time_format)
+        collected = []
+        printed = False
+
+        mode = "Collecting"
+        if ignore:
+            mode = "Ignoring"
+
+        while not clock.expired():
+            try:
+                messages = await self.collect_count(1,
+                                                    timeout=clock.wait(timeout))
+            except TimeoutError:
+                if clock.deadline is not None:
+                    break  # no more messages within the duration
+                raise
+
+            if not ignore:
+                collected.extend(messages)
+
+            done = clock.add(messages[-1])
+
+            if verbose and clock.amount is not None:
+                printProgressBar(
+                    clock.amount,
+                    clock.total,
+                    prefix=f'{mode} messages for {clock.total} seconds',
+                    suffix='Complete',
+                    length=50)
+                printed = True
+
+            if done:
+                break
+
+        if printed:
+            print(end="\n")
+
+        return collected
+
+
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None,
+                                      functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MessageBuffer holds decoded messages that have been received but not yet
+collected, e.g. when one frame from the experiment contains more messages
+than were asked for.
+
+It is bounded, so that a fast stream cannot use up all the memory, and it
+counts what it drops. What happens when it is full is set by `overflow`:
+
+    "drop-oldest" - discard the oldest message to make room (default)
+    "drop-newest" - discard the message being added
+    "block"       - wait until a consumer makes room
+
+Adding and removing messages takes constant time, and is thread-safe, so
+a receiver thread can fill the buffer while the user's code empties it.
+
+"""
+import collections
+import threading
+
+OVERFLOW_POLICIES = ("drop-oldest", "drop-newest", "block")
+
+
+class MessageBuffer:
+
+    def __init__(self, capacity=100000, overflow="drop-oldest"):
+
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow}, valid options are: " +
+                ", ".join(OVERFLOW_POLICIES))
+
+        self.capacity = capacity
+        self.closed = False
+        self.error = None
+        self.overflow = overflow
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.not_full.notify_all()
+
+    def close(self, error=None):
+        # called by the producer when no more messages will arrive, so that
+        # a consumer waiting in get() raises error (or EOFError) once the
+        # remaining messages have been read
+        with self.lock:
+            self.closed = True
+            self.error = error
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def extend(self, items, block=True, timeout=None):
+        # returns the number of items that were added
+        added = 0
+        with self.lock:
+            for item in items:
+                if self._put(item, block, timeout):
+                    added += 1
+        return added
+
+    def get(self, timeout=None):
+        # wait for the next message, raising TimeoutError if none arrives
+        with self.lock:
+            if not self.not_empty.wait_for(
+                    lambda: len(self.items) > 0 or self.closed, timeout):
+                raise TimeoutError("timed out waiting for message")
+            if len(self.items) == 0:
+                raise self.error or EOFError("message buffer closed")
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    def popleft(self):
+        # get the next message without waiting, raising IndexError if empty
+        with self.lock:
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    def put(self, item, block=True, timeout=None):
+        # returns False if the item was dropped
+        # with the "block" policy, a producer that is also the consumer
+        # would wait forever, so it should use block=False, in which case
+        # a full buffer raises OverflowError instead
+        with self.lock:
+            return self._put(item, block, timeout)
+
+    def _put(self, item, block, timeout):
+        # must be called with self.lock held
+        if len(self.items) >= self.capacity:
+            if self.overflow == "drop-oldest":
+                self.items.popleft()
+                self.dropped_oldest += 1
+            elif self.overflow == "drop-newest":
+                self.dropped_newest += 1
+                return False
+            elif not block:
+                raise OverflowError("message buffer is full (capacity %d)" %
+                                    (self.capacity))
+            elif not self.not_full.wait_for(
+                    lambda: len(self.items) < self.capacity or self.closed,
+                    timeout):
+                raise TimeoutError("timed out waiting for space in buffer")
+
+        self.items.append(item)
+        self.not_empty.notify()
+        return True
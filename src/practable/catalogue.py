@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catalogue indexes the experiments in the groups a Booker has added, by name,
+group and number (the first number in the name, e.g. 51 for
+"Spinner 51 (Open Days)"), so that they can be found without scanning the
+whole list, e.g.
+
+    catalogue.find(substring="Spinner", number=(40, 60))
+    catalogue.find(prefix="Spinner 5", group="g-open-x3fca8")
+    catalogue.find(regex=r"Spinner \\d+ \\(Open")
+
+Each experiment appears once, however many times its group is added, and
+adding a group again only re-indexes the experiments in that group.
+
+Exact, prefix, group and number queries use hash or sorted indexes.
+Substring queries of three or more characters use an index of the
+three-character sequences in each name, so only names containing all of
+them are checked. A regex is checked against every name that matches the
+other criteria.
+
+"""
+import bisect
+import re
+
+NUMBER = re.compile(r"\d+")
+
+
+class Catalogue:
+
+    def __init__(self):
+        self.by_group = {}  # group: set of names
+        self.by_number = {}  # number: set of names
+        self.details = {}  # name: details from the booking server
+        self.groups = {}  # name: set of groups
+        self.names = []  # sorted
+        self.numbers = []  # sorted
+        self.trigrams = {}  # three characters: set of names
+
+    def __contains__(self, name):
+        return name in self.details
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_group(self, group, experiments):
+        # experiments is a dict of name: details for every experiment in
+        # the group, replacing what was indexed for that group before
+        for name in list(self.by_group.get(group, ())):
+            if name not in experiments:
+                self.remove(name, group)
+
+        for name, details in experiments.items():
+            self.add(name, group, details)
+
+    def add(self, name, group, details):
+        self.details[name] = details
+
+        if name not in self.groups:
+            self.groups[name] = set()
+            bisect.insort(self.names, name)
+
+            number = experiment_number(name)
+            if number is not None:
+                if number not in self.by_number:
+                    self.by_number[number] = set()
+                    bisect.insort(self.numbers, number)
+                self.by_number[number].add(name)
+
+            for trigram in trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(name)
+
+        self.groups[name].add(group)
+        self.by_group.setdefault(group, set()).add(name)
+
+    def remove(self, name, group):
+        self.by_group[group].discard(name)
+        self.groups[name].discard(group)
+
+        if len(self.groups[name]) > 0:
+            return  # still in another group
+
+        del self.groups[name]
+        del self.details[name]
+        del self.names[bisect.bisect_left(self.names, name)]
+
+        number = experiment_number(name)
+        if number is not None:
+            self.by_number[number].discard(name)
+            if len(self.by_number[number]) == 0:
+                del self.by_number[number]
+                del self.numbers[bisect.bisect_left(self.numbers, number)]
+
+        for trigram in trigrams(name):
+            self.trigrams[trigram].discard(name)
+            if len(self.trigrams[trigram]) == 0:
+                del self.trigrams[trigram]
+
+    def find(self,
+             exact=None,
+             prefix=None,
+             substring=None,
+             regex=None,
+             number=None,
+             group=None):
+        # names of the experiments matching all of the criteria given,
+        # sorted by name
+        # number is an int, or an inclusive (lowest, highest) range, or a
+        # python range e.g. range(40, 61)
+
+        candidates = None  # None means every name
+
+        def narrow(names):
+            nonlocal candidates
+            if candidates is None:
+                candidates = set(names)
+            else:
+                candidates &= set(names)
+
+        if exact is not None:
+            narrow([exact] if exact in self.details else [])
+
+        if group is not None:
+            narrow(self.by_group.get(group, ()))
+
+        if number is not None:
+            if isinstance(number, int):
+                narrow(self.by_number.get(number, ()))
+            else:
+                if isinstance(number, range):
+                    lowest, highest = number.start, number.stop - 1
+                else:
+                    lowest, highest = number
+                i = bisect.bisect_left(self.numbers, lowest)
+                j = bisect.bisect_right(self.numbers, highest)
+                narrow(name for n in self.numbers[i:j]
+                       for name in self.by_number[n])
+
+        if prefix is not None:
+            i = bisect.bisect_left(self.names, prefix)
+            j = bisect.bisect_left(self.names, prefix + "\U0010ffff")
+            narrow(self.names[i:j])
+
+        if substring is not None:
+            for trigram in trigrams(substring):
+                narrow(self.trigrams.get(trigram, ()))
+
+        if candidates is None:
+            candidates = self.names
+
+        if regex is not None:
+            regex = re.compile(regex)
+
+        return sorted(
+            name for name in candidates
+            if (substring is None or substring in name) and (
+                regex is None or regex.search(name) is not None))
+
+    def get(self, name):
+        return self.details[name]
+
+
+def experiment_number(name):
+    # the first number in the name, or None if there isn't one
+    m = NUMBER.search(name)
+    if m is None:
+        return None
+    return int(m.group())
+
+
+def trigrams(s):
+    return set(s[i:i + 3] for i in range(len(s) - 2))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RateLimiter spaces out the commands sent to an experiment, and CommandQueue
+sends them from a background thread, so that the user's code need not wait
+for them, e.g.
+
+    expt.commands(['{"set":"mode","to":"position"}',
+                   '{"set":"position","to":2}'], block=False)
+
+RateLimiter is a token bucket: up to `burst` commands can be sent at once,
+after which they are limited to `rate` per second. The default of 20 per
+second with a burst of 1 keeps commands at least 50ms apart, so that each
+arrives at the experiment as a separate message, but unlike a fixed sleep
+after every command, time already spent doing something else counts
+towards the gap.
+
+Acknowledgement waits for a message from the experiment which shows that a
+command has taken effect, e.g. one with "c": 2 once the set point has been
+changed, instead of waiting a fixed time. Each message received is checked
+against the acknowledgements that are being waited for.
+
+"""
+import queue
+import threading
+import time
+
+
+class RateLimiter:
+
+    def __init__(self, rate=20, burst=1):
+        # rate is in commands per second, or None for no limit
+
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be more than 0, or None")
+
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        # wait until a command can be sent
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self):
+        # take a token, returning the seconds to wait before using it, so
+        # that callers which can't block (e.g. asyncio) can wait their own way
+        if self.rate is None:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens can go below zero, so that concurrent callers queue up
+            # behind each other rather than all waking at once
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class Acknowledgement:
+
+    def __init__(self, match):
+        # match is a function of a message, returning True if the message
+        # is the acknowledgement
+        self.event = threading.Event()
+        self.match = match
+        self.message = None
+
+    def check(self, message):
+        # returns True if message is the acknowledgement
+        try:
+            matched = self.match(message)
+        except (KeyError, IndexError, TypeError):
+            matched = False
+
+        if matched:
+            self.message = message
+            self.event.set()
+        return matched
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+
+class CommandQueue:
+
+    def __init__(self, send, name="practable-sender"):
+        # send(message, ack, timeout) sends one command, waiting for its
+        # acknowledgement if there is one; commands are sent in the order
+        # queued, and an exception stops the rest being sent, and is kept in
+        # self.error to be raised by the next call to put() or join()
+
+        self.closed = False
+        self.error = None
+        self.queue = queue.Queue()
+        self.send = send
+
+        self.thread = threading.Thread(target=self.send_loop,
+                                       name=name,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # send any remaining commands, without waiting for acknowledgements
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def join(self):
+        # wait until every queued command has been sent
+        self.queue.join()
+        self.raise_error()
+
+    def put(self, message, ack=None, timeout=None):
+        self.raise_error()
+        if self.closed:
+            raise RuntimeError("the command queue is closed")
+        self.queue.put((message, ack, timeout))
+
+    def raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def send_loop(self):
+        # runs in the sender thread
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:  # after an error, drop the rest
+                    message, ack, timeout = item
+                    self.send(message, None if self.closed else ack, timeout)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
@@ -11,7 +11,8 @@ Experiment class handles connecting to the experiments themselves
 @author: tim
 
 """
-import collections.abc
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 import json
 import math
@@ -20,19 +21,104 @@ from platformdirs import user_config_dir
 from pathlib import Path
 import random
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import time
 from urllib.parse import urlparse
 
+from websockets.exceptions import ConnectionClosed
 from websockets.sync.client import connect as wsconnect
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import numpy as np
+except ImportError:  # only needed for Experiment.to_arrays
+    np = None
+
+from practable.buffer import MessageBuffer
+from practable.catalogue import Catalogue
+from practable.command import Acknowledgement, CommandQueue, RateLimiter
+from practable.decimate import make_decimator
+from practable.decode import Decoder
+from practable.history import History
+from practable.keys import compile_key, first_value, is_sequence, lookup
+from practable.record import Recorder, Recording
+from practable.stats import QUANTILES, StreamStats
+from practable.trace import carry, span
+from practable.stream import MessageStream
+
+# responses worth retrying, because they are usually transient
+# (rate limiting, or a proxy in front of the booking server restarting)
+RETRY_STATUS = (429, 502, 503, 504)
+
+# responses that mean the server did not act on the request, so that any
+# request can be retried, e.g. making a booking; a gateway error (502, 504)
+# may come after the server has acted on it
+UNPROCESSED_STATUS = (429, 503)
+
+# safe to repeat if we don't know whether the server acted on the request
+IDEMPOTENT_METHODS = ("DELETE", "GET", "HEAD", "OPTIONS", "PUT")
+
+# path segments which are followed by an id, see endpoint()
+ENDPOINT_IDS = ("access", "bookings", "groups", "login", "session", "slots",
+                "users")
+
+# clocks that a duration can be measured on, see Experiment.messages
+STOP_ON = ("message", "local")
+
+# types of value that are never lists of values, which saves checking
+# whether each value is a sequence, see to_arrays()
+SCALARS = (int, float, bool, str, type(None))
+
+# stands in for a key that a message doesn't have, see to_arrays()
+MISSING = object()
+
+# seconds to allow for differences between our clock and the booking server's
+CLOCK_MARGIN = 1
+
+# longest wait in seconds between attempts to reconnect a dropped stream
+RECONNECT_MAX_DELAY = 10
+
 
 class Booker:
 
     def __init__(self,
                  book_server="https://app.practable.io/ed0/book",
-                 config_in_cwd=False):
+                 config_in_cwd=False,
+                 pool_size=10,
+                 timeout=10,
+                 retries=3,
+                 backoff=0.5,
+                 cache_ttl=timedelta(hours=1),
+                 metrics=None,
+                 tracer=None):
 
         self.book_server = book_server
+        # a Metrics to record the time taken by each request, see
+        # practable.metrics, or None
+        self.metrics = metrics
+        # a Tracer to record a span for each request, see practable.trace,
+        # or None
+        self.tracer = tracer
+
+        # share keep-alive connections between calls, so that only the first
+        # call to each host pays for the TCP and TLS handshakes
+        # timeout is in seconds, and applies to each attempt
+        # retries is how many times to repeat a request that failed transiently
+        # backoff is the base delay in seconds, which doubles on each retry
+        self.backoff = backoff
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
         # create a configuration directory for the book_server
         # some users may use more than one booking server so keep them separate
@@ -41,16 +127,27 @@ class Booker:
         # Jupyter notebooks
 
         u = urlparse(book_server)
+        # activities by experiment name, and by booking; an activity lasts
+        # as long as its booking, so it is only fetched once per booking
         self.activities = {}
+        self.activity_cache = {}
+        # the Booker may be shared by Experiments on several threads (e.g. in
+        # a Fleet, or reconnecting in a receiver thread)
+        self.activities_lock = threading.Lock()
         self.host = u.netloc
         self.app_author = "practable"
         self.app_name = "practable-python-" + u.netloc.replace(
             ".", "-") + u.path.replace("/", "-")
         self.bookings = []
+        # group details rarely change, so they are cached on disk for
+        # cache_ttl, and then revalidated with the booking server
+        self.cache_ttl = cache_ttl
         self.groups = []
         self.group_details = {}
+        # experiments in the groups added so far, see Catalogue
+        self.catalogue = Catalogue()
         self.experiments = []
-        self.experiment_details = {}
+        self.experiment_details = self.catalogue.details
 
         if config_in_cwd:  #for jupyter notebooks
             self.ucd = os.getcwd()
@@ -71,7 +168,7 @@ class Booker:
     def add_group(self, group):
         self.ensure_logged_in()
         url = self.book_server + "/api/v1/users/" + self.user + "/groups/" + group
-        r = requests.post(url, headers=self.headers)
+        r = self.request("POST", url, authorized=True)
 
         if r.status_code != 204:
             print(r.status_code)
@@ -80,12 +177,15 @@ class Booker:
 
         self.groups.append(group)
 
-    def book(self, duration, selected=""):
+    def book(self, duration, selected="", start=None):
+        # start is when the booking begins, or None for now
+        # returns the name of the experiment booked
 
         if not isinstance(duration, timedelta):
             raise TypeError("duration must be a datetime.timedelta")
 
-        start = datetime.now(timezone.utc)
+        if start is None:
+            start = datetime.now(timezone.utc)
         end = start + duration
 
         if selected == "":
@@ -113,18 +213,51 @@ class Booker:
             "to": end.isoformat(),
         }
 
-        r = requests.post(url, params=params, headers=self.headers)
+        r = self.request("POST", url, params=params, authorized=True)
 
         if r.status_code != 204:
             print(r.status_code)
             print(r.text)
             raise Exception("could not book %s for %s" % (selected, duration))
 
+        return selected
+
+    def book_soonest(self, duration, max_wait=None):
+        # book an experiment from self.available if there is one, otherwise
+        # queue for whichever experiment in self.unavailable is free soonest
+        # returns (name, start), so the caller can wait until start
+        # max_wait is a timedelta; experiments that aren't free until later
+        # than that are not booked
+        # note: use filter_experiments first, as for book
+        now = datetime.now(timezone.utc)
+
+        if len(self.available) > 0:
+            return self.book(duration), now
+
+        upcoming = sorted(
+            (start, name) for name, start in self.unavailable.items()
+            if start is not None and (max_wait is None
+                                      or start <= now + max_wait))
+
+        if len(upcoming) == 0:
+            raise Exception(
+                "There are no experiments matching `%s` free within %s" %
+                (self.filter_name, max_wait))
+
+        # another user may book the soonest one first, so try the next
+        for start, name in upcoming:
+            try:
+                return self.book(duration, selected=name, start=start), start
+            except Exception as e:
+                error = e
+
+        raise error
+
     def cancel_booking(self, name):
 
         url = self.book_server + "/api/v1/users/" + self.user + "/bookings/" + name
 
-        r = requests.delete(url, headers=self.headers)
+        r = self.request("DELETE", url, authorized=True)
 
         if r.status_code != 404:
             print(r.status_code)
@@ -148,7 +281,7 @@ class Booker:
 
     def check_slot_available(self, slot):
         url = self.book_server + "/api/v1/slots/" + slot
-        r = requests.get(url, headers=self.headers)
+        r = self.request("GET", url, authorized=True)
         if r.status_code != 200:
             print(r.status_code)
             print(r.text)
@@ -167,27 +300,100 @@ class Booker:
 
         return available_now, when
 
+    def close(self):
+        # release the pooled connections
+        self.session.close()
+
     def ensure_logged_in(
             self):  #most booking operations take much less than a minute
 
         if not self.exp > (datetime.now() + timedelta(minutes=2)):
 
-            self.ensure_user()
+            # the token is shared with other processes using the same config
+            # dir, so lock it to stop parallel workers all logging in at once
+            with file_lock(os.path.join(self.ucd, 'login.lock')):
 
-            r = requests.post(self.book_server + "/api/v1/login/" + self.user)
+                self.ensure_user()
 
-            if r.status_code != 200:
-                print(r.status_code)
-                print(r.text)
-                raise Exception("could not login as user %s at %s" %
-                                (self.user, self.booking_server))
+                # another process may have logged in while we waited
+                if self.load_token():
+                    return
 
-            rj = r.json()
-            self.exp = datetime.fromtimestamp(rj["exp"])
-            self.headers = {
-                'Content-Type': 'application/json',
-                'Authorization': '{}'.format(rj['token'])
-            }
+                r = self.request(
+                    "POST", self.book_server + "/api/v1/login/" + self.user)
+
+                if r.status_code != 200:
+                    print(r.status_code)
+                    print(r.text)
+                    raise Exception("could not login as user %s at %s" %
+                                    (self.user, self.book_server))
+
+                rj = r.json()
+                self.set_token(rj["token"], rj["exp"])
+                self.save_token(rj["token"], rj["exp"])
+
+    def forget_token(self):
+        # after the booking server rejects the token, so that we log in
+        # again, and other processes don't use it either
+        self.exp = datetime.now()
+        with file_lock(os.path.join(self.ucd, 'login.lock')):
+            try:
+                os.remove(self.token_path())
+            except OSError:
+                pass
+
+    def load_token(self):
+        # use the token saved by an earlier login, if it is for this user
+        # and booking server, and not about to expire; returns True if it
+        # was used
+        try:
+            with open(self.token_path()) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if saved.get("user") != self.user or saved.get(
+                "book_server") != self.book_server:
+            return False
+
+        if not datetime.fromtimestamp(
+                saved["exp"]) > (datetime.now() + timedelta(minutes=2)):
+            return False
+
+        self.set_token(saved["token"], saved["exp"])
+        return True
+
+    def save_token(self, token, exp):
+        # the token is a credential, so only the user can read it
+        path = self.token_path()
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as file:
+                json.dump(
+                    {
+                        "book_server": self.book_server,
+                        "user": self.user,
+                        "token": token,
+                        "exp": exp
+                    }, file)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # we can still use the token in this process
+
+    def token_path(self):
+        # the config dir may be shared by several booking servers (e.g. with
+        # config_in_cwd=True), so each has its own token file, as each has
+        # its own group cache
+        server = self.app_name.replace(":", "-")
+        return os.path.join(self.ucd, server + "-token")
+
+    def set_token(self, token, exp):
+        self.exp = datetime.fromtimestamp(exp)
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Authorization': '{}'.format(token)
+        }
 
     def ensure_user(self):
         # check if we have previously stored a user name in config dir
@@ -202,7 +408,7 @@ class Booker:
             pass
 
         #if get to here, user is not found, or empty, so get a new one
-        r = requests.post(self.book_server + "/api/v1/users/unique")
+        r = self.request("POST", self.book_server + "/api/v1/users/unique")
         if r.status_code != 200:
             print(r.status_code)
             print(r.text)
@@ -215,79 +421,169 @@ class Booker:
 
     def set_user(self, user):
 
+        if user != getattr(self, "user", None):
+            self.exp = datetime.now()  #login again as the new user
+
         with open(os.path.join(self.ucd, 'user'), 'w') as file:
             file.write(user)
         self.user = user
 
-    def filter_experiments(self, sub, number="", exact=False):
+    def filter_experiments(self,
+                           sub,
+                           number="",
+                           exact=False,
+                           workers=8,
+                           first=None,
+                           match="substring",
+                           group=None):
+        # list the experiments whose names match sub, where match is one of
+        # "substring", "exact", "prefix" or "regex" (exact=True is the same
+        # as match="exact"), optionally only those in one group
+        # number is a string that must also be in the name, or the number
+        # in the name as an int, or an inclusive range of them e.g. (40, 60)
+        # the slot availability of each matching experiment is checked
+        # concurrently, using up to `workers` connections at a time
+        # set first=N to stop checking once N available experiments are found,
+        # in which case self.unavailable may not list every busy experiment
         self.filter_name = sub
         self.filter_number = number
         self.available = []
         self.unavailable = {}
-        self.listed = []
 
-        if exact == True and sub in self.experiments:
-            self.listed.append(sub)
+        if exact == True:
+            match = "exact"
 
-        else:
+        if match not in ("substring", "exact", "prefix", "regex"):
+            raise ValueError(
+                f"Unknown match {match}, valid options are: substring, exact, prefix, regex"
+            )
 
-            for name in self.experiments:
-                if sub in name:
-                    if number == "":
-                        self.listed.append(name)
-                    else:
-                        if number in name:
-                            self.listed.append(name)
-
-        for name in self.listed:
-            available_now, when = self.check_slot_available(
-                self.experiment_details[name]["slot"])
-            if available_now:
-                self.available.append(name)
-            else:
-                self.unavailable[name] = when["start"]
+        query = {match: sub, "group": group}
+        if not isinstance(number, str):
+            query["number"] = number
+
+        self.listed = self.catalogue.find(**query)
 
-    def get_activity(self, booking):
+        if isinstance(number, str) and number != "":
+            self.listed = [name for name in self.listed if number in name]
+
+        if len(self.listed) == 0:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            executor.submit(carry(self.tracer, self.check_slot_available),
+                            self.experiment_details[name]["slot"]): name
+            for name in self.listed
+        }
+
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                available_now, when = future.result()
+                if available_now:
+                    self.available.append(name)
+                    if first is not None and len(self.available) >= first:
+                        break
+                else:
+                    # when is empty if the slot has no availability at all
+                    self.unavailable[name] = when["start"] if when else None
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        # keep the listed order, so results don't depend on response timing
+        order = {name: i for i, name in enumerate(self.listed)}
+        self.available.sort(key=order.get)
+
+    def evict_activities(self, bookings=None):
+        # forget activities that have expired, or whose booking is not in
+        # bookings (e.g. because it was cancelled), if bookings is given
+        now = datetime.now(timezone.utc).timestamp()
+        with self.activities_lock:
+            for booking, activity in list(self.activity_cache.items()):
+                if activity["exp"] < now or (bookings is not None
+                                             and booking not in bookings):
+                    del self.activity_cache[booking]
+            for name, activity in list(self.activities.items()):
+                if activity["booking"] not in self.activity_cache:
+                    del self.activities[name]
+
+    def fetch_activity(self, booking):
         #get the activity associated with a booking (use the uuid in the name field)
         url = self.book_server + "/api/v1/users/" + self.user + "/bookings/" + booking
-        r = requests.put(url, headers=self.headers)
+        r = self.request("PUT", url, authorized=True)
         if r.status_code != 200:
             print(r.status_code)
             print(r.text)
             raise Exception("could not get activity for booking %s" %
                             (booking))
 
-        #remove stale activities
-        activities = self.activities
-        now = datetime.now(timezone.utc)
-        for activity in activities:
-            if datetime.fromtimestamp(activity["exp"], tz=timezone.utc) > now:
-                del self.activities[activity]
-
         ad = r.json()
         # we can only link an activity with a booking at the time we request it
         # so we need to store that link in the activity to allow cancellation
         # cancelling all bookings will interfere with other instances operating
         # on the same machine
         ad["booking"] = booking  #so we can identify which booking to cancel
-
-        name = ad["description"]["name"]
-        self.activities[name] = ad
-
-    def get_all_activities(self):
-        for booking in self.bookings:
-            #print("getting activity for " + booking["name"] + " for " + booking["slot"])
-            self.get_activity(booking["name"])
+        return ad
+
+    def get_activity(self, booking, refresh=False):
+        # the activity for a booking, from the cache unless it has expired
+        # or refresh=True
+        self.evict_activities()
+
+        ad = self.activity_cache.get(booking)
+        if ad is None or refresh:
+            ad = self.fetch_activity(booking)
+            self.store_activity(ad)
+        return ad
+
+    def get_all_activities(self, names=None, workers=8):
+        # get the activities for the current bookings (see get_bookings),
+        # fetching those not already cached at the same time as each other
+        # names limits this to the bookings for those experiments, as long
+        # as their slots are known from get_group_details
+        self.evict_activities()
+
+        bookings = self.bookings
+        if names is not None and all(name in self.experiment_details
+                                     for name in names):
+            slots = set(self.experiment_details[name]["slot"]
+                        for name in names)
+            bookings = [b for b in bookings if b.get("slot") in slots]
+
+        missing = [
+            b["name"] for b in bookings if b["name"] not in self.activity_cache
+        ]
+        if len(missing) == 0:
+            return
+        if len(missing) == 1:
+            self.store_activity(self.fetch_activity(missing[0]))
+            return
+
+        # only the requests are made on the worker threads, so that the
+        # dicts of activities are only changed here
+        with ThreadPoolExecutor(
+                max_workers=min(workers, len(missing))) as executor:
+            for ad in executor.map(carry(self.tracer, self.fetch_activity),
+                                   missing):
+                self.store_activity(ad)
+
+    def store_activity(self, ad):
+        with self.activities_lock:
+            self.activity_cache[ad["booking"]] = ad
+            self.activities[ad["description"]["name"]] = ad
 
     def get_bookings(self):
         self.ensure_logged_in()
         url = self.book_server + "/api/v1/users/" + self.user + "/bookings"
-        r = requests.get(url, headers=self.headers)
+        r = self.request("GET", url, authorized=True)
         if r.status_code != 200:
             print(r.status_code)
             print(r.text)
             raise Exception("could not get bookings for %s from %s" %
-                            (self.user, self.booking_server))
+                            (self.user, self.book_server))
 
         bookings = r.json()
 
@@ -302,27 +598,177 @@ class Booker:
             if now >= start and now <= end:
                 self.bookings.append(booking)
 
-    def get_group_details(self):
+        # activities for bookings that have ended or been cancelled are no
+        # use for connecting
+        self.evict_activities(set(b["name"] for b in self.bookings))
+
+    def get_group_details(self, refresh=False):
+        # set refresh=True to ignore the cache and download everything again
         self.ensure_logged_in()
 
         for group in self.groups:
-            url = self.book_server + "/api/v1/groups/" + group
-            r = requests.get(url, headers=self.headers)
-            if r.status_code != 200:
-                print(r.status_code)
-                print(r.text)
-                raise Exception("could not get group details for group %s" %
-                                (group))
-
-            gd = r.json()
+            gd = self.get_cached_group(group, refresh=refresh)
             self.group_details[group] = gd
+            experiments = {}
             for policy in gd["policies"].values():
                 for slot in policy["slots"]:
                     v = policy["slots"][slot]
                     v["slot"] = slot
                     name = v["description"]["name"]
-                    self.experiments.append(name)
-                    self.experiment_details[name] = v
+                    experiments[name] = v
+            self.catalogue.add_group(group, experiments)
+
+        self.experiments = list(self.catalogue)
+
+    def get_cached_group(self, group, refresh=False):
+        # return the details of a group, from the cache if they are less than
+        # cache_ttl old, otherwise from the booking server, which only sends
+        # them again if they have changed since they were cached
+
+        # the cache may be shared by several booking servers (e.g. with
+        # config_in_cwd=True), which could each have a group of this name
+        server = self.app_name.replace(":", "-")
+        path = os.path.join(self.ucd, "cache",
+                            server + "-group-" + group + ".json")
+        cached = None
+
+        if not refresh:
+            try:
+                with open(path) as file:
+                    cached = json.load(file)
+            except (OSError, ValueError):
+                pass  # not cached, or the cache file is unreadable
+
+        if cached is not None:
+            age = datetime.now(timezone.utc) - datetime.fromtimestamp(
+                cached["fetched"], tz=timezone.utc)
+            if age < self.cache_ttl:
+                return cached["details"]
+
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        url = self.book_server + "/api/v1/groups/" + group
+        r = self.request("GET", url, authorized=True, headers=headers)
+
+        if r.status_code == 304 and cached is not None:
+            gd = cached["details"]
+        elif r.status_code == 200:
+            gd = r.json()
+            cached = {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "details": gd,
+            }
+        else:
+            print(r.status_code)
+            print(r.text)
+            raise Exception("could not get group details for group %s" %
+                            (group))
+
+        cached["fetched"] = datetime.now(timezone.utc).timestamp()
+
+        # write to a temporary file first, so that other processes never
+        # read a partly written cache file
+        try:
+            Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "w") as file:
+                json.dump(cached, file)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # caching is only an optimisation
+
+        return gd
+
+    def request(self, method, url, authorized=False, **kwargs):
+        # all calls to the booking server go through here, so that they share
+        # the pooled connections, and transient failures are retried with
+        # jittered exponential backoff instead of aborting the whole run
+        # authorized=True sends our token, along with any other headers
+
+        kwargs.setdefault("timeout", self.timeout)
+        headers = kwargs.pop("headers", {})
+        if authorized:
+            kwargs["headers"] = dict(self.headers, **headers)
+        else:
+            kwargs["headers"] = headers
+        r = self.request_with_retries(method, url, **kwargs)
+
+        if r.status_code == 401 and authorized:
+            # our token was rejected (e.g. the server restarted, or it was
+            # saved by another process that has since logged in again), so
+            # log in again, once
+            self.forget_token()
+            self.ensure_logged_in()
+            kwargs["headers"] = dict(self.headers, **headers)
+            r = self.request_with_retries(method, url, **kwargs)
+
+        return r
+
+    def request_with_retries(self, method, url, **kwargs):
+        attempt = 0
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else UNPROCESSED_STATUS
+
+        with span(self.tracer, "%s %s" % (method, endpoint(url))) as s:
+            while True:
+                delay = None
+                started = time.perf_counter()
+                try:
+                    r = self.session.request(method, url, **kwargs)
+                    self.record_request(method, url, started, r.status_code)
+                    if (r.status_code not in retry_status
+                            or attempt >= self.retries):
+                        s.set("status", r.status_code)
+                        s.set("retries", attempt)
+                        s.set("request_bytes", len(r.request.body or b""))
+                        s.set("response_bytes", len(r.content))
+                        return r
+                    delay = retry_after(r)
+                except requests.ConnectTimeout:
+                    # the request was never sent, so it is safe to repeat
+                    self.record_request(method, url, started, "error")
+                    if attempt >= self.retries:
+                        s.set("retries", attempt)
+                        raise
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    # the server may have acted on the request (e.g. if the
+                    # connection dropped while waiting for the response), so
+                    # only repeat it if it is safe to do so (e.g. not making a
+                    # booking)
+                    status = "timeout" if isinstance(
+                        e, requests.Timeout) else "error"
+                    self.record_request(method, url, started, status)
+                    if attempt >= self.retries or not idempotent:
+                        s.set("retries", attempt)
+                        raise
+
+                if delay is None:
+                    delay = random.uniform(0, self.backoff * 2**attempt)
+                if self.metrics is not None:
+                    self.metrics.inc("http_retries_total",
+                                     method=method,
+                                     endpoint=endpoint(url))
+                time.sleep(delay)
+                attempt += 1
+
+    def record_request(self, method, url, started, status):
+        if self.metrics is None:
+            return
+        path = endpoint(url)
+        self.metrics.observe("http_request_seconds",
+                             time.perf_counter() - started,
+                             method=method,
+                             endpoint=path)
+        self.metrics.inc("http_requests_total",
+                         method=method,
+                         endpoint=path,
+                         status=str(status))
 
     def connect(self, name, which="data"):
 
@@ -345,7 +791,7 @@ class Booker:
             'Authorization': '{}'.format(token)
         }
 
-        r = requests.post(url, headers=headers)
+        r = self.request("POST", url, headers=headers)
         if r.status_code != 200:
             print(r.status_code)
             print(r.text)
@@ -369,7 +815,6 @@ class Experiment(object):
     # default behaviour on exit is to cancel a booking if we made it, not if it
     # already existed (e.g. was made online)
 
-    #TODO add a look ahead feature for making bookings "soon" (queueing)
     #TODO consier different object for fresh booking versus prebooking as behavoour is different?
     #TODO consider adding e.g. 8 character xcvf-6311 code for each booking that a user can get from bookjs
     #     along with the necessary example code to use the booking, to simplify the information
@@ -390,109 +835,290 @@ class Experiment(object):
                  time_key="t",
                  key_separator="/",
                  cancel_new_booking_on_exit=True,
-                 max_wait_to_start=timedelta(minutes=1)):
-
-        if book_server == "":
-            self.booker = Booker(
-                config_in_cwd=config_in_cwd)  #use the default booking server
-        else:
-            self.booker = Booker(book_server=book_server,
-                                 config_in_cwd=config_in_cwd)
-
+                 max_wait_to_start=timedelta(minutes=1),
+                 buffer_capacity=100000,
+                 buffer_overflow="drop-oldest",
+                 background=False,
+                 decoder="auto",
+                 booker=None,
+                 queue=False,
+                 command_rate=20,
+                 command_burst=1,
+                 retention=None,
+                 metrics=None,
+                 tracer=None,
+                 reconnect=True,
+                 reconnect_backoff=0.5,
+                 on_gap=None):
+
+        # a Metrics to record rates, latencies etc, see practable.metrics
+        self.metrics = metrics
+        # a Tracer to time the phases of __enter__, see practable.trace
+        self.tracer = tracer
+        self.command_sent = None  # time.monotonic() of the last command
+        self.lag_offset = None  # least that message time was behind ours
+
+        # a Booker can be shared between Experiments, in which case it is
+        # left open on exit for the other Experiments to use
+        self.own_booker = booker is None
+        if booker is None:
+            booker = self.make_booker(book_server, config_in_cwd)
+        self.booker = booker
+
+        # commands are limited to command_rate per second (None for no
+        # limit), after the first command_burst, see RateLimiter
+        self.command_limiter = RateLimiter(rate=command_rate,
+                                           burst=command_burst)
+        self.command_sender = None  # CommandQueue, for block=False
         self.duration = duration
         self.exact = exact
         self.group = group
         self.key_separator = key_separator
+        # set queue=True to book whichever matching experiment is free
+        # soonest, if none are free now, and wait for the booking to start,
+        # as long as that is within max_wait_to_start
+        self.max_wait_to_start = max_wait_to_start
         self.name = name
         self.number = number
-        self.stashed_messages = []
+        self.queue = queue
+        # messages received but not yet collected; see MessageBuffer for the
+        # overflow policies, and for counts of dropped messages
+        self.stashed_messages = MessageBuffer(capacity=buffer_capacity,
+                                              overflow=buffer_overflow)
+        # set background=True to read the websocket continuously in a
+        # receiver thread, so that messages are not left waiting in the
+        # websocket while the user's code is busy (e.g. sleeping or plotting)
+        # the collect methods then read from the buffer instead
+        self.background = background
+        # decoder is a Decoder, or the name of the JSON library to use;
+        # messages that can't be decoded are counted in self.decoder.errors
+        if isinstance(decoder, Decoder):
+            self.decoder = decoder
+        else:
+            self.decoder = Decoder(decoder)
+        # set retention to keep the messages received over that many
+        # seconds, indexed by time, for window(), last() and since(), see
+        # History; use background=True too, to keep them as they arrive
+        self.time_path = compile_key(time_key, key_separator)
+        self.history = None
+        if retention is not None:
+            if time_format != "ms":
+                raise Exception("time_format not implemented")
+            self.history = History(self.time_value, retention=retention)
+        self.receiver = None
+        self.receiver_stop = threading.Event()
+        self.recorder = None
         self.time_format = time_format
         self.time_key = time_key
         self.user = user
         self.cancel_new_booking_on_exit = cancel_new_booking_on_exit
+        self.cancel_booking_on_exit = False
+        # Acknowledgements being waited for, checked against each message
+        self.waiters = []
+        self.waiters_lock = threading.Lock()
+        # if the connection drops, connect again for as long as the booking
+        # lasts, waiting reconnect_backoff seconds at first, then doubling
+        # up to RECONNECT_MAX_DELAY; each outage is added to self.gaps, with
+        # the message times either side of it, and passed to on_gap(gap)
+        self.gap = None  # the outage being recovered from
+        self.gaps = []
+        self.last_objs = []  # the last messages received, to time outages
+        self.on_gap = on_gap
+        self.reconnect_backoff = reconnect_backoff
+        self.auto_reconnect = reconnect
+        # notified when the receiver thread replaces the websocket, or gives
+        # up (setting stream_lost), for send() to wait on during an outage
+        self.reconnected = threading.Condition()
+        self.stream_lost = False
 
     def __enter__(self):
+        with span(self.tracer,
+                  "enter",
+                  group=self.group,
+                  experiment=self.name):
+            self.enter()
+        return self
+
+    def enter(self):
+        # each phase has a span, so a Tracer shows where the time goes
+        tracer = self.tracer
+
         # set a specific user, e.g. online identity used to book the kit already
         # i.e. a booking we want to use interactively without cancelling it
         if self.user != "":
-            self.booker.set_user(self.user)
-
-        self.booker.add_group(self.group)
+            with span(tracer, "set_user"):
+                self.booker.set_user(self.user)
+
+        with span(tracer, "add_group"):
+            self.booker.add_group(self.group)
+        # the group details (usually cached on disk) give the experiment's
+        # slot, so only the activity for its booking needs to be fetched
+        with span(tracer, "get_group_details"):
+            self.booker.get_group_details()
         # see if we have an existing booking
-        self.booker.get_bookings()
-        self.booker.get_all_activities()
+        with span(tracer, "get_bookings"):
+            self.booker.get_bookings()
+        with span(tracer, "get_all_activities"):
+            self.booker.get_all_activities(names=[self.name])
 
         try:
-            self.url = self.booker.connect(self.name)
+            with span(tracer, "connect"):
+                self.url = self.booker.connect(self.name)
             self.cancel_booking_on_exit = False
         except KeyError:
             # make a booking
-            self.booker.get_group_details()
-            self.booker.filter_experiments(self.name, self.number, self.exact)
-            self.booker.book(self.duration)
-            self.booker.get_bookings()
-            self.booker.get_all_activities()
-            self.url = self.booker.connect(self.name)
+            with span(tracer, "filter_experiments"):
+                self.booker.filter_experiments(self.name, self.number,
+                                               self.exact)
+            if self.queue:
+                with span(tracer, "book_soonest"):
+                    self.name, start = self.booker.book_soonest(
+                        self.duration, max_wait=self.max_wait_to_start)
+                with span(tracer, "wait_until"):
+                    self.wait_until(start)
+            else:
+                with span(tracer, "book") as s:
+                    self.name = self.booker.book(self.duration)
+                    s.set("booked", self.name)
+            with span(tracer, "get_bookings"):
+                self.booker.get_bookings()
+            with span(tracer, "get_all_activities"):
+                self.booker.get_all_activities(names=[self.name])
+            with span(tracer, "connect"):
+                self.url = self.booker.connect(self.name)
             self.cancel_booking_on_exit = self.cancel_new_booking_on_exit
 
-        # https://websockets.readthedocs.io/en/stable/reference/sync/client.html
-        self.websocket = wsconnect(self.url)
-        return self
+        with span(tracer, "open"):
+            self.open(self.url)
 
     def __exit__(self, *args):
+        self.stop_sender()
+        self.stop_receiver()
+        self.stop_recording()
         self.websocket.close()
         if self.cancel_booking_on_exit:
             #identify and cancel booking
             booking = self.booker.activities[self.name]["booking"]
             self.booker.cancel_booking(booking)
+        if self.own_booker:
+            self.booker.close()
+
+    def collect_count(self, count, timeout=None, verbose=True, decimate=None):
+        # count is the number of messages received, before any decimation
+        messages = self.messages(count=count, timeout=timeout, verbose=verbose)
+        if decimate is not None:
+            messages = self.decimated(messages, decimate)
+        return list(messages)
+
+    def command(self, message, verbose=True, block=True, ack=None, timeout=5):
+        # send a command to the experiment
+        # set block=False to queue the command to be sent in the background,
+        # in order, and return at once; flush_commands() waits for them
+        # ack is a dict of key: value, or a function of a message, matching
+        # the message that shows the command has taken effect, e.g.
+        # ack={"c": 2}; the command then waits for it (up to timeout seconds,
+        # raising TimeoutError) before returning, or before the next queued
+        # command is sent
+        # note: with block=False, acknowledgements are only seen while
+        # messages are being read, so use background=True, or keep
+        # collecting while the commands are sent
+        if verbose:
+            print("Command: " + message)
 
-    def collect_count(self, count, timeout=None, verbose=True):
-        messages = []
-        collected = 0
-
-        while collected < count:
-            try:
-                # getg next stashed message
-                message = self.stashed_messages.pop(0)
-                messages.append(message)
-                collected += 1
-
-            except IndexError:  # no stashed messages
-                message = self.recv(timeout=timeout)
-                #print("recevied message: " + message)
+        if block:
+            self.flush_commands()  # keep the commands in order
+            self.send_command(message, ack, timeout)
+            return
+
+        if self.command_sender is None:
+            self.command_sender = CommandQueue(self.send_command,
+                                               name="practable-sender-" +
+                                               self.name)
+        self.command_sender.put(message, ack, timeout)
+
+    def commands(self,
+                 messages,
+                 verbose=True,
+                 block=True,
+                 ack=None,
+                 timeout=5):
+        # send several commands, as for command(), where ack (if any) is for
+        # the last one, e.g. to wait until a whole configuration has been set
+        for i, message in enumerate(messages):
+            last = i == len(messages) - 1
+            self.command(message,
+                         verbose=verbose,
+                         block=block,
+                         ack=ack if last else None,
+                         timeout=timeout)
+
+    def flush_commands(self):
+        # wait until all the commands queued with block=False have been sent,
+        # raising any exception that stopped them
+        if self.command_sender is not None:
+            self.command_sender.join()
+
+    def send_command(self, message, ack=None, timeout=5):
+        if ack is None:
+            self.send(message)
+            return
+
+        if callable(ack):
+            match = ack
+        else:
+            paths = [(compile_key(key, self.key_separator), value)
+                     for key, value in ack.items()]
+            match = lambda obj: all(
+                lookup(obj, path) == value for path, value in paths)
 
-                for line in message.splitlines():
-                    try:
-                        if line != "":
-                            obj = json.loads(line)
-
-                            if collected < count:
-                                messages.append(obj)
-                                collected += 1
-                            else:
-                                # got too many messages at once, now exceeded count
-                                # so stash messages not needed
-                                self.stashed_messages.append(obj)
-                    except json.JSONDecodeError:
-                        print("Warning could not decode as JSON:" + line)
-            if verbose:
-                printProgressBar(collected,
-                                 count,
-                                 prefix=f'Collecting {count} messages',
-                                 suffix='Complete',
-                                 length=50)
+        waiter = Acknowledgement(match)
+        with self.waiters_lock:
+            self.waiters.append(waiter)
 
-        if verbose:
-            print(
-                end="\n"
-            )  #make sure next message does not overwrite completed progress bar
+        try:
+            sent = time.monotonic()
+            self.send(message)
+            self.wait_for_acknowledgement(waiter, timeout)
+            if self.metrics is not None:
+                self.metrics.observe("command_ack_seconds",
+                                     time.monotonic() - sent,
+                                     experiment=self.name)
+        finally:
+            with self.waiters_lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    def wait_for_acknowledgement(self, waiter, timeout):
+        # if nothing else is reading the websocket, read it here, stashing
+        # the messages so they can still be collected
+        reading = self.receiver is None and (
+            self.command_sender is None
+            or threading.current_thread() is not self.command_sender.thread)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not waiter.is_set():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        "no acknowledgement from %s within %s seconds" %
+                        (self.name, timeout))
+            if reading:
+                try:
+                    objs = self.receive_frame(timeout=remaining)
+                except TimeoutError:
+                    continue
+                self.stashed_messages.extend(objs, block=False)
+            else:
+                waiter.wait(remaining)
 
-        return messages
+        return waiter.message
 
-    def command(self, message, verbose=True):
-        if verbose:
-            print("Command: " + message)
-        self.send(message)
+    def decode(self, message):
+        # decode each line of a message from the experiment as JSON
+        return self.decoder.decode(message)
 
     def extract(self, obj, key, separator="/"):
 
@@ -502,194 +1128,946 @@ class Experiment(object):
         # These may not be at the top level of the object
         # e.g. key="data/time" means we're returning message["data"]["time"]
 
-        keys = key.split(separator)
-
-        if len(keys) == 0:
-            return None
-
-        v = obj
-        try:
-            for k in keys:
-                v = v[k]
-                return v
-        except KeyError:
-            raise KeyError("time key not found in this message")
+        return lookup(obj, compile_key(key, separator))
 
     def extract_series(self, arr, key, separator="/"):
+        path = compile_key(key, separator)
         values = []
         for obj in arr:
-            vv = self.extract(obj, key, separator=separator)
-            for v in vv:
-                values.append(v)
+            vv = lookup(obj, path)
+            if is_sequence(vv):
+                values.extend(vv)
+            else:
+                values.append(vv)
         return values
 
+    def to_arrays(self,
+                  arr,
+                  keys,
+                  separator=None,
+                  missing="skip",
+                  ragged="allow",
+                  structured=False):
+        # Extract several keys from a list of messages, in a single pass,
+        # returning a dict of numpy arrays, e.g.
+        # data = expt.to_arrays(messages, ["t", "d", "c", "data/time"])
+        # plt.plot(data["t"], data["d"])
+        #
+        # A key's value in a message may be a single value or a list of them.
+        #
+        # missing sets what happens when a message does not have a key:
+        #   "skip"  - the message adds nothing to that key's array
+        #   "nan"   - the message adds NaN, once for each value the message
+        #             has for the other keys (so rows stay aligned)
+        #   "raise" - raise KeyError
+        #
+        # ragged sets what happens when the keys in a message have different
+        # numbers of values:
+        #   "allow"    - keep them all; arrays may end up different lengths
+        #   "truncate" - keep only as many values as the shortest key has
+        #   "raise"    - raise ValueError
+        #
+        # structured=True returns one numpy structured array with a field
+        # for each key instead, which needs all the arrays to be the same
+        # length (e.g. use missing="nan", ragged="truncate")
+
+        if np is None:
+            raise ImportError(
+                "to_arrays needs numpy, try: pip install practable[numpy]")
+
+        if missing not in ("skip", "nan", "raise"):
+            raise ValueError(
+                f"Unknown missing policy {missing}, valid options are: skip, nan, raise"
+            )
+
+        if ragged not in ("allow", "truncate", "raise"):
+            raise ValueError(
+                f"Unknown ragged policy {ragged}, valid options are: allow, truncate, raise"
+            )
+
+        if isinstance(keys, str):
+            keys = [keys]
+
+        if separator is None:
+            separator = self.key_separator
+
+        paths = [compile_key(key, separator) for key in keys]
+
+        if ragged == "allow" and missing != "nan":
+            # each key is independent of the others, so take them one at a
+            # time, which is much quicker than building a row per message
+            arrays = {
+                key: np.asarray(column_values(arr, path, missing == "raise"))
+                for key, path in zip(keys, paths)
+            }
+            return structured_array(arrays) if structured else arrays
+
+        # the value of each key in each message, or MISSING,
+        # with single values as 1-tuples only if some messages have lists
+        raw = [
+            message_values(arr, path, missing == "raise") for path in paths
+        ]
+
+        if not any(lists for values, lists in raw):
+            # every message has one value (or none) for each key, so they
+            # line up without checking lengths
+            if missing == "nan":
+                columns = [[math.nan if v is MISSING else v for v in values]
+                           for values, lists in raw]
+            else:
+                columns = [[v for v in values if v is not MISSING]
+                           for values, lists in raw]
+            arrays = {key: np.asarray(c) for key, c in zip(keys, columns)}
+            return structured_array(arrays) if structured else arrays
+
+        raw = [[
+            v if v is MISSING or v.__class__ not in SCALARS and is_sequence(v)
+            else (v, ) for v in values
+        ] for values, lists in raw]
+        columns = [[] for key in keys]
+
+        for row in zip(*raw):
+            lengths = [len(v) for v in row if v is not MISSING]
+            if ragged == "raise" and len(set(lengths)) > 1:
+                raise ValueError("keys %s have different lengths %s" %
+                                 (keys, lengths))
+            if len(lengths) == 0:
+                width = 1
+            elif ragged == "truncate":
+                width = min(lengths)
+            else:
+                width = max(lengths)
+
+            for values, v in zip(columns, row):
+                if v is MISSING:
+                    if missing == "nan":
+                        values.extend([math.nan] * width)
+                elif ragged == "truncate":
+                    values.extend(v[:width])
+                else:
+                    values.extend(v)
+
+        arrays = {key: np.asarray(values) for key, values in zip(keys, columns)}
+
+        return structured_array(arrays) if structured else arrays
+
+    def receive_loop(self):
+        # runs in the receiver thread, until stop_receiver() is called or
+        # the connection fails, when the buffer is closed with the reason
+        # so that anyone waiting for messages gets the exception
+        try:
+            while not self.receiver_stop.is_set():
+                try:
+                    objs = self.receive_frame(timeout=0.1)
+                except TimeoutError:
+                    continue
+
+                for obj in objs:
+                    # with the "block" overflow policy, wait for space but
+                    # keep checking whether we have been asked to stop
+                    while not self.receiver_stop.is_set():
+                        try:
+                            self.stashed_messages.put(obj, timeout=0.1)
+                            break
+                        except TimeoutError:
+                            continue
+        except Exception as e:
+            self.stashed_messages.close(e)
+        finally:
+            self.lose_stream()
+
+    def make_booker(self, book_server, config_in_cwd):
+        if book_server == "":
+            return Booker(config_in_cwd=config_in_cwd,
+                          metrics=self.metrics,
+                          tracer=self.tracer)  #use the default booking server
+        else:
+            return Booker(book_server=book_server,
+                          config_in_cwd=config_in_cwd,
+                          metrics=self.metrics,
+                          tracer=self.tracer)
+
+    def open(self, url):
+        # connect to the stream at url, e.g. from Booker.connect()
+        # __enter__ does this for you, after finding or making a booking
+        self.url = url
+
+        # https://websockets.readthedocs.io/en/stable/reference/sync/client.html
+        self.websocket = wsconnect(self.url)
+
+        if self.background:
+            self.start_receiver()
+
+    def wait_until(self, start):
+        # sleep until a queued booking starts, in one go rather than polling,
+        # plus a little in case the booking server's clock is behind ours
+        wait = (start - datetime.now(timezone.utc)).total_seconds()
+        if wait > 0:
+            print("Waiting until %s for %s" %
+                  (start.astimezone().strftime("%H:%M:%S"), self.name))
+            time.sleep(wait + CLOCK_MARGIN)
+
+    def receive_frame(self, timeout=None):
+        # receive one frame, record it if we are recording, and decode it
+        frame = self.recv(timeout=timeout)
+        if self.recorder is not None:
+            self.recorder.write(frame)
+        started = time.perf_counter()
+        objs = self.decode(frame)
+        if self.metrics is not None:
+            self.record_frame(frame, objs, time.perf_counter() - started)
+        if len(objs) > 0:
+            if self.gap is not None:
+                self.end_gap(objs)
+            self.last_objs = objs
+        if self.history is not None:
+            self.history.add(objs)
+        if len(self.waiters) > 0:
+            self.check_waiters(objs)
+        return objs
+
+    def record_frame(self, frame, objs, decode_seconds):
+        m = self.metrics
+        name = self.name
+        now = time.monotonic()
+
+        if isinstance(frame, str):
+            frame = frame.encode("utf-8")
+        m.inc("frames_total", experiment=name)
+        m.inc("messages_total", len(objs), experiment=name)
+        m.inc("bytes_total", len(frame), experiment=name)
+        m.observe("decode_seconds", decode_seconds, experiment=name)
+        m.set("stash_depth", len(self.stashed_messages), experiment=name)
+
+        sent = self.command_sent
+        if sent is not None:
+            self.command_sent = None
+            m.observe("command_response_seconds", now - sent, experiment=name)
+
+        if len(objs) > 0:
+            try:
+                behind = now - self.message_time(objs[-1]).total_seconds()
+            except KeyError:
+                return
+            if self.lag_offset is None or behind < self.lag_offset:
+                self.lag_offset = behind
+            lag = behind - self.lag_offset
+            m.set("time_key_lag_current_seconds", lag, experiment=name)
+            m.observe("time_key_lag_seconds", lag, experiment=name)
+
+    def check_waiters(self, objs):
+        with self.waiters_lock:
+            for waiter in list(self.waiters):
+                for obj in objs:
+                    if waiter.check(obj):
+                        self.waiters.remove(waiter)
+                        break
+
+    def record(self,
+               path,
+               chunk_bytes=1000000,
+               flush_interval=1.0,
+               append=False):
+        # write every frame received from now on to path, see Recorder,
+        # until stop_recording() is called or the experiment is closed
+        # replay it later with ReplayExperiment(path)
+        # path is replaced if it exists, unless append=True
+        # only the .log format is supported, so other extensions (e.g.
+        # .parquet or .npz) are refused rather than written as a log
+        extension = os.path.splitext(path)[1]
+        if extension != ".log":
+            raise ValueError(
+                "Unsupported recording format %s, the path must end in .log" %
+                (extension))
+        self.stop_recording()
+        self.recorder = Recorder(path,
+                                 chunk_bytes=chunk_bytes,
+                                 flush_interval=flush_interval,
+                                 append=append)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
     def recv(self, timeout=None):
-        return self.websocket.recv(timeout=timeout)
+        # not to be used while the receiver thread is running
+        while True:
+            try:
+                return self.websocket.recv(timeout=timeout)
+            except ConnectionClosed:
+                if not self.reconnect():
+                    raise
 
-    def send(self, message):
-        self.websocket.send(message)
-        time.sleep(0.05)  #rate limiting step to ensure messages are separate
+    def booking_ends(self):
+        # the end of the booking we are connected with, or None if unknown
+        try:
+            exp = self.booker.activities[self.name]["exp"]
+        except (AttributeError, KeyError):
+            return None
+        return datetime.fromtimestamp(exp, tz=timezone.utc)
+
+    def reconnect(self):
+        # after the connection drops, get a fresh stream URI and connect
+        # again, with backoff, for as long as the booking lasts
+        # returns False if there is no booking to reconnect with
+        ends = self.booking_ends()
+        if not self.auto_reconnect or ends is None:
+            self.lose_stream()
+            return False
+
+        dropped = time.monotonic()
+        if self.gap is None:
+            self.gap = {
+                "start": self.gap_time(reversed(self.last_objs), last=True),
+                "end": None,
+                "seconds": None,
+                "reconnects": 0,
+                "failures": 0,  # attempts to reconnect that failed
+                "error": None,  # from the last attempt that failed
+            }
+        if self.metrics is not None:
+            self.metrics.inc("reconnects_total", experiment=self.name)
 
-    def ignore(self, duration_seconds, timeout=None, verbose=True):
-        return self.collect_duration(duration_seconds,
-                                     timeout=None,
-                                     verbose=True,
-                                     ignore=True)
+        attempt = 0
+        with span(self.tracer, "reconnect", experiment=self.name) as s:
+            while datetime.now(timezone.utc) < ends:
+                try:
+                    try:
+                        url = self.booker.connect(self.name)
+                    except Exception:
+                        # the stream tokens may have expired, so get the
+                        # activity again
+                        self.booker.get_activity(
+                            self.booker.activities[self.name]["booking"],
+                            refresh=True)
+                        url = self.booker.connect(self.name)
+                    websocket = wsconnect(url)
+                    with self.reconnected:
+                        self.websocket = websocket
+                        self.url = url
+                        self.reconnected.notify_all()
+                    self.gap["reconnects"] += 1
+                    self.gap["seconds"] = time.monotonic() - dropped
+                    s.set("attempts", attempt + 1)
+                    return True
+                except Exception as e:
+                    self.gap["failures"] += 1
+                    self.gap["error"] = str(e)
+
+                remaining = (ends - datetime.now(timezone.utc)).total_seconds()
+                delay = min(self.reconnect_backoff * 2**attempt,
+                            RECONNECT_MAX_DELAY, remaining)
+                # give up if stop_receiver() is called meanwhile
+                if self.receiver_stop.wait(max(0, delay)):
+                    break
+                attempt += 1
+
+        self.lose_stream()
+        return False
+
+    def lose_stream(self):
+        # no more reconnecting, so stop send() waiting for it
+        with self.reconnected:
+            self.stream_lost = True
+            self.reconnected.notify_all()
+
+    def wait_for_reconnect(self, websocket):
+        # wait for the receiver thread to replace websocket after it drops,
+        # returning False if the receiver stops or gives up instead
+        with self.reconnected:
+            self.reconnected.wait_for(
+                lambda: self.websocket is not websocket or self.stream_lost)
+            return self.websocket is not websocket
+
+    def end_gap(self, objs):
+        # the first messages since reconnecting, which end the gap
+        gap = self.gap
+        self.gap = None
+        gap["end"] = self.gap_time(objs)
+        self.gaps.append(gap)
+        if self.on_gap is not None:
+            self.on_gap(gap)
+
+    def gap_time(self, objs, last=False):
+        # time in the first message with one, or None; the last of its
+        # times if it has several and last=True
+        for obj in objs:
+            try:
+                v = lookup(obj, self.time_path)
+            except KeyError:
+                continue
+            if is_sequence(v):
+                if len(v) == 0:
+                    continue
+                return v[-1] if last else v[0]
+            return v
+        return None
 
-    def collect(self, duration_seconds, timeout=None, verbose=True):
+    def send(self, message):
+        self.command_limiter.acquire()  # to ensure messages are separate
+        if self.history is not None:
+            self.history.mark(message)  # for since()
+        if self.metrics is not None:
+            self.command_sent = time.monotonic()
+        websocket = self.websocket
+        try:
+            websocket.send(message)
+        except ConnectionClosed:
+            # the receiver thread reconnects by itself, if there is one
+            if self.receiver is not None:
+                if not self.wait_for_reconnect(websocket):
+                    raise
+            elif not self.reconnect():
+                raise
+            self.websocket.send(message)
+
+    def start_receiver(self):
+        # start reading the websocket in a background thread
+        if self.receiver is not None:
+            return
+        self.receiver_stop.clear()
+        self.stream_lost = False
+        self.receiver = threading.Thread(target=self.receive_loop,
+                                         name="practable-receiver-" +
+                                         self.name,
+                                         daemon=True)
+        self.receiver.start()
+
+    def stop_sender(self):
+        # send any queued commands, then stop the sender thread
+        if self.command_sender is not None:
+            self.command_sender.close()
+            self.command_sender = None
+
+    def stop_receiver(self):
+        if self.receiver is None:
+            return
+        self.receiver_stop.set()
+        self.receiver.join()
+        self.receiver = None
+
+    def ignore(self,
+               duration_seconds,
+               timeout=None,
+               verbose=True,
+               stop_on="message"):
+        return self.collect_duration(duration_seconds,
+                                     timeout=timeout,
+                                     verbose=verbose,
+                                     ignore=True,
+                                     stop_on=stop_on)
+
+    def collect(self,
+                duration_seconds,
+                timeout=None,
+                verbose=True,
+                stop_on="message",
+                decimate=None):
         return self.collect_duration(duration_seconds,
-                                     timeout=None,
-                                     verbose=True,
-                                     ignore=False)
+                                     timeout=timeout,
+                                     verbose=verbose,
+                                     ignore=False,
+                                     stop_on=stop_on,
+                                     decimate=decimate)
 
     def collect_duration(self,
                          duration_seconds,
                          timeout=None,
                          verbose=True,
-                         ignore=False):
+                         ignore=False,
+                         stop_on="message",
+                         decimate=None):
         # implementation of collect() and ignore()
         # select ignore=True for ignore()
         # duration is a float, to make interface easier to type/understand for new users
         # e.g.
         # collect(0.5)  vs
         # collect(timedelta(milliseconds=500))
-        collected = []
-
-        mode = "Collecting"
+        # stop_on="local" measures the duration on our own clock instead of
+        # in message time, see messages()
+        # decimate thins out the messages as they arrive, so that only the
+        # ones returned are kept, e.g. decimate=10, see practable.decimate
+        messages = self.messages(duration=duration_seconds,
+                                 timeout=timeout,
+                                 verbose=verbose,
+                                 ignore=ignore,
+                                 stop_on=stop_on)
         if ignore:
-            mode = "Ignoring"
+            for message in messages:
+                pass
+            return []
+
+        if decimate is not None:
+            messages = self.decimated(messages, decimate)
+
+        return list(messages)
+
+    def decimated(self, messages, decimate):
+        # messages thinned out by a decimator, or every nth if decimate=n
+        decimator = make_decimator(decimate)
+        decimator.start(self.time_value,
+                        separator=self.key_separator,
+                        time_path=self.time_path)
+        return decimator.run(messages)
+
+    def last(self, duration):
+        # the messages kept over the last `duration` seconds, in message time
+        return self.get_history().last(duration)
+
+    def since(self, command=None):
+        # the messages kept since a command was sent, or since the last
+        # command if command is None
+        return self.get_history().since(command)
+
+    def window(self, t_start=None, t_end=None):
+        # the messages kept with t_start <= time < t_end, in the units of the
+        # time in the messages, e.g. ms
+        return self.get_history().window(t_start, t_end)
+
+    def get_history(self):
+        if self.history is None:
+            raise Exception(
+                "no history is kept, set retention to keep messages for window, last and since"
+            )
+        return self.history
+
+    def summarize(self,
+                  duration=None,
+                  keys=("d", ),
+                  count=None,
+                  quantiles=QUANTILES,
+                  bucket=None,
+                  on_bucket=None,
+                  keep_buckets=True,
+                  timeout=None,
+                  verbose=True,
+                  stop_on="message"):
+        # running statistics of keys in the messages received over duration
+        # seconds (or count messages), without keeping the messages, see
+        # StreamStats; bucket is in seconds, for statistics per time period
+        # e.g. stats = expt.summarize(3600, ["d", "c"], bucket=60)
+        stats = StreamStats(keys,
+                            quantiles=quantiles,
+                            bucket=bucket,
+                            time_of=self.time_value,
+                            separator=self.key_separator,
+                            on_bucket=on_bucket,
+                            keep_buckets=keep_buckets)
+
+        for message in self.messages(duration=duration,
+                                     count=count,
+                                     timeout=timeout,
+                                     verbose=verbose,
+                                     stop_on=stop_on):
+            stats.add(message)
+
+        stats.finish()
+        return stats
+
+    def time_value(self, message):
+        # the time in a message, as it is in the message (e.g. ms), or the
+        # first one if it has several, raising KeyError if there isn't one
+        return first_value(lookup(message, self.time_path))
+
+    def message_time(self, message, first=False):
+        # the time of a message, which is either a single time value, or an
+        # array of them, in which case use the first or last one
+        # we exclude handling arrays of sub-objects each containing a time-stamp
+        # because this complicates the filter implementation
+        times = self.extract(message,
+                             self.time_key,
+                             separator=self.key_separator)
+
+        if is_sequence(times):
+            times = times[0] if first else times[-1]
+
+        if self.time_format == "ms":
+            return timedelta(milliseconds=times)
+        else:
+            raise Exception("time_format not implemented")
 
-        duration = timedelta(seconds=duration_seconds)
+    def messages(self,
+                 duration=None,
+                 count=None,
+                 until=None,
+                 timeout=None,
+                 callbacks=None,
+                 verbose=False,
+                 ignore=False,
+                 stop_on="message"):
+        # Generator that yields messages one at a time as they arrive.
+        # It stops after `count` messages, or once the time in the messages
+        # has advanced by `duration` seconds, or after a message for which
+        # until(message) is True, whichever comes first. With none of these,
+        # it continues until the connection closes.
+        # callbacks (a function, or list of them) are called with each
+        # message before it is yielded
+        # stop_on sets the clock that duration is measured on:
+        #   "message" - the time in the messages (see time_key), from the
+        #               first one; if they stop arriving, it stops once
+        #               the rest of the duration has passed on our own clock
+        #   "local"   - our own clock, from now, so no time_key is needed
+        # timeout is how long to wait for the first message, or for each
+        # message if there is no duration
+        # ignore=True is used by ignore()
+
+        if callbacks is None:
+            callbacks = []
+        elif callable(callbacks):
+            callbacks = [callbacks]
+
+        clock = None  # a DurationClock, when waiting for a duration
+
+        if duration is not None:
+            clock = DurationClock(duration,
+                                  self.message_time,
+                                  stop_on=stop_on,
+                                  time_format=self.time_format)
+
+            mode = "Collecting"
+            if ignore:
+                mode = "Ignoring"
+
+        n = 0  # messages yielded
+        printed = False  # whether there is a progress bar to finish
 
-        if self.time_format != "ms":
+        try:
+            while count is None or n < count:
+
+                wait = timeout
+                if clock is not None:
+                    if clock.expired():
+                        return
+                    wait = clock.wait(timeout)
+
+                try:
+                    message = self.next_message(timeout=wait)
+                except TimeoutError:
+                    if clock is not None and clock.deadline is not None:
+                        return  # no more messages within the duration
+                    raise
+                except EOFError:
+                    return  # e.g. the end of a recording
+
+                done = clock is not None and clock.add(message)
+
+                for callback in callbacks:
+                    callback(message)
+
+                yield message
+                n += 1
+
+                if until is not None and until(message):
+                    return
+
+                if clock is None:
+                    if verbose and count is not None:
+                        printProgressBar(n,
+                                         count,
+                                         prefix=f'Collecting {count} messages',
+                                         suffix='Complete',
+                                         length=50)
+                        printed = True
+                    continue
+
+                if verbose and clock.amount is not None:
+                    printProgressBar(
+                        clock.amount,
+                        clock.total,
+                        prefix=f'{mode} messages for {clock.total} seconds',
+                        suffix='Complete',
+                        length=50)
+                    printed = True
+
+                if done:
+                    return
+
+        finally:
+            if printed:
+                print(
+                    end="\n"
+                )  #ensure next line does not overwrite our finished progress bar
+
+    def next_message(self, timeout=None):
+        # the next message, from the stash if there is one, otherwise from
+        # the receiver thread, or the websocket
+        try:
+            return self.stashed_messages.popleft()
+        except IndexError:  # no stashed messages
+            pass
+
+        if self.receiver is not None:
+            # wait for the receiver thread to stash more
+            return self.stashed_messages.get(timeout=timeout)
+
+        objs = []
+        while len(objs) == 0:
+            objs = self.receive_frame(timeout=timeout)
+
+        # got more than one message at once, so stash the rest
+        self.stashed_messages.extend(objs[1:], block=False)
+        return objs[0]
+
+    def stream(self,
+               duration=None,
+               count=None,
+               until=None,
+               timeout=None,
+               callbacks=None,
+               verbose=False,
+               stop_on="message"):
+        # Like messages(), but the messages can be transformed as they
+        # arrive with map(), filter(), decimate() etc, without keeping them
+        # all in memory, e.g. for a long soak test
+        # for d in expt.stream(duration=3600).decimate(10).map(lambda m: m["d"]):
+        return MessageStream(
+            self.messages(duration=duration,
+                          count=count,
+                          until=until,
+                          timeout=timeout,
+                          callbacks=callbacks,
+                          verbose=verbose,
+                          stop_on=stop_on))
+
+
+class DurationClock:
+    # Decides when to stop taking messages for a duration, for
+    # Experiment.messages and AsyncExperiment.collect_duration.
+    #
+    # We're tracking two different forms of time here: the time in the
+    # messages, if we are getting them, and the time that has passed on our
+    # own clock, if we're not. stop_on sets which one the duration is on:
+    #   "message" - the time in the messages (see time_key), from the
+    #               first one; if they stop arriving, it stops once the
+    #               rest of the duration has passed on our own clock
+    #   "local"   - our own clock, from now, so no time_key is needed
+
+    def __init__(self,
+                 duration_seconds,
+                 message_time,
+                 stop_on="message",
+                 time_format="ms"):
+
+        if stop_on not in STOP_ON:
+            raise ValueError(f"Unknown stop_on {stop_on}, valid options are: " +
+                             ", ".join(STOP_ON))
+
+        if stop_on == "message" and time_format != "ms":
             raise KeyError(
-                f"Unknown time_format {self.time_format}, valid options are: ms"
-            )
+                f"Unknown time_format {time_format}, valid options are: ms")
+
+        self.duration = timedelta(seconds=duration_seconds)
+        self.total = self.duration.total_seconds()
+        self.message_time = message_time
+        self.stop_on = stop_on
+
+        self.amount = None  # seconds of the duration passed, if known
+        self.deadline = None  # time.monotonic() after which to stop waiting
+        if stop_on == "local":
+            self.deadline = time.monotonic() + self.total
+        self.gap = 0  # longest wait between messages so far, in seconds
+        self.received = None  # time.monotonic() when the last message arrived
+        self.t0 = None  # time of the first message
+
+    def expired(self):
+        # whether the duration has passed on our own clock, with
+        # stop_on="local", so no more messages are wanted
+        return self.stop_on == "local" and time.monotonic() >= self.deadline
+
+    def wait(self, timeout=None):
+        # how long to wait for the next message: exactly as long as is left,
+        # so a quiet stream can't hold us up; once the deadline has passed,
+        # only messages that have already arrived are taken, and any later
+        # ones are left for the next call
+        if self.deadline is None:
+            return timeout
+        return max(self.deadline - time.monotonic(), 0)
+
+    def add(self, message):
+        # note that a message has arrived, returning True if the time in it
+        # is past the end of the duration, so it is the last one wanted
+        now = time.monotonic()
+        if self.received is not None:
+            self.gap = max(self.gap, now - self.received)
+        self.received = now
+
+        if self.stop_on == "local":
+            self.amount = min(self.total - (self.deadline - now), self.total)
+            return False
+
+        self.amount = None
+        first = self.t0 is None
+        try:
+            t = self.message_time(message, first=first)
+        except KeyError:
+            return False  #no times in this message, so keep checking
 
-        while True:
+        if first:
+            self.t0 = t
 
-            messages = self.collect_count(1, timeout=timeout, verbose=False)
-            # the value is either a single time value, or an array of them
-            # we exclude handling arrays of sub-objects each containing a time-stamp
-            # because this complicates the filter implementation
+        # we need to stop if the stream goes quiet, so wait for the next
+        # message for no longer than the message time still to go, or the
+        # longest gap between messages so far (e.g. when messages arrive in
+        # batches), whichever is longer
+        self.deadline = self.received + max(
+            (self.duration - (t - self.t0)).total_seconds(), self.gap)
 
-            if not ignore:
-                for message in messages:
-                    collected.append(message)
+        if first:
+            return False
 
-            try:
-                times = self.extract(messages[0],
-                                     self.time_key,
-                                     separator=self.key_separator)
-                break
-            except KeyError:
-                continue
+        # there are multiple timestamps per message, so the time can
+        # overshoot the duration; don't show that in the progress bar
+        self.amount = min((t - self.t0).total_seconds(), self.total)
 
-        t0 = timedelta()
+        # check if the time in the message has reached the time we are
+        # waiting for
+        return (t - self.t0) > self.duration
 
-        if self.time_format == "ms":
-            if isinstance(times, collections.abc.Sequence) and not isinstance(times, str):
-                t0 = timedelta(milliseconds=times[0])
-            else:
-                t0 = timedelta(milliseconds=times)
-        else:
-            raise Exception("time_format not implemented")
 
-        t1 = t0 + duration  #the time we're waiting for, in the messages
+class ReplayExperiment(Experiment):
+    # Replays a recording made with Experiment.record(), through the same
+    # collect, stream and extract methods, without needing the hardware
+    # or the booking system, e.g.
+    # with ReplayExperiment("run.log") as expt:
+    #     messages = expt.collect(60)
+    # Commands are ignored. Other arguments are as for Experiment.
+
+    def __init__(self, path, **kwargs):
+        super().__init__("", path, **kwargs)
+        self.path = path
+        self.recording = None
+
+    def __enter__(self):
+        self.recording = Recording(self.path)
+        self.frames = self.recording.frames()
 
-        # we're tracking two different forms of time here
-        # the time in the messages, if we are getting them
-        # and the time that has passed on our own clock, if we're not
-        # we need to stop ignoring if there are no messages in the given time
+        if self.background:
+            self.start_receiver()
 
-        endtime = datetime.now() + duration
+        return self
 
-        #timeout is in seconds, so round up to nearest whole seconds
-        # if this is longer than we want to wait, no worries, because
-        # it only times out if there was no data anyway.
-        timeout = math.ceil(duration.total_seconds())
+    def __exit__(self, *args):
+        self.stop_sender()
+        self.stop_receiver()
+        self.stop_recording()
+        self.recording.close()
 
-        count = 0
+    def make_booker(self, book_server, config_in_cwd):
+        return None
 
-        while True:
+    def recv(self, timeout=None):
+        try:
+            received, frame = next(self.frames)
+        except StopIteration:
+            raise EOFError("end of recording %s" % (self.path))
+        return frame
 
-            try:
-                messages = self.collect_count(1,
-                                              timeout=timeout,
-                                              verbose=False)
-
-            except TimeoutError:
-                # timed out, so return
-                return collected
-
-            # check for edge case for ignore, which is that:
-            # if no message is received while we are ignoring
-            # but then we get one after the ignore duration has expired
-            # but before the timeout we created with whole number
-            # seconds has expired (e.g. a message at 700ms on a 500ms ignore,
-            # which requires a 1s timeout) then
-            # we have to stash it to be received by user
-            # in case there are sparsely/unevenly spaced but important
-            # messages being sent and the ignore is set to a fractional
-            # seconds value. Otherwise we can ignore it.
-
-            if ignore and datetime.now() >= endtime:
-                if count == 0:
-                    #stash message, if it is the first one we get
-                    # and it comes after the expected ignore duration
-                    # but before websocket.recv() second-granularity timeout
-                    # is reached
-                    for message in messages:
-                        self.stashed_messages.append(message)
-                return collected
-
-            if not ignore:
-                for message in messages:
-                    collected.append(message)
-            count += len(messages)  #increment ignore count
-
-            # check if the time in the message has reached the time we are
-            # waiting for, t1
-
-            #want the last message, as that is the most recent
-            try:
-                times = self.extract(messages[-1],
-                                     self.time_key,
-                                     separator=self.key_separator)
-            except KeyError:
-                continue  #no times in this message, so keep checking
+    def send(self, message):
+        pass
 
-            t1 = timedelta()
 
-            if self.time_format == "ms":
-                if isinstance(times,collections.abc.Sequence) and not isinstance(times, str):
-                    t1 = timedelta(milliseconds=times[-1])
-                else:
-                    t1 = timedelta(milliseconds=times)
+@contextlib.contextmanager
+def file_lock(path):
+    # hold an exclusive lock on path, which is shared between processes
+    with open(path, "a") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
             else:
-                raise Exception("time_format not implemented")
-
-            if verbose:
-                # progress bar tends to overshoot, because there are multiple timestamps per message
-                # Ignoring messages for 1.0 seconds |██████████████████████████████████████████████████| 101.8% Complete
-                # let's hide that under the rug for now, to be easier for new users
-
-                amount = (t1 - t0).total_seconds()
-                total = duration.total_seconds()
-                if amount > total:
-                    amount = total
-                printProgressBar(
-                    amount,
-                    total,
-                    prefix=
-                    f'{mode} messages for {duration.total_seconds()} seconds',
-                    suffix='Complete',
-                    length=50)
-            if (t1 - t0) > duration:
-                print(
-                    end="\n"
-                )  #ensure next line does not overwrite our finished progress bar
-                return collected
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def endpoint(url):
+    # the path of a url with the ids replaced by {}, so that requests to
+    # the same endpoint are counted together in the metrics
+    parts = urlparse(url).path.split("/")
+    for i in range(1, len(parts)):
+        if parts[i - 1] in ENDPOINT_IDS:
+            parts[i] = "{}"
+    return "/".join(parts)
+
+
+def column_values(arr, path, required=False):
+    # the values of one key in a list of messages, as a flat list, skipping
+    # messages without it unless required=True, when they raise KeyError
+    values = []
+    append = values.append
+    extend = values.extend
+    for obj in arr:
+        v = obj
+        try:
+            for k in path:
+                v = v[k]
+        except (KeyError, IndexError, TypeError):
+            if required:
+                raise KeyError("key %s not found in this message" %
+                               ("/".join(path)))
+            continue
+        if v.__class__ is list:  # as decoded from JSON
+            extend(v)
+        elif v.__class__ in SCALARS or not is_sequence(v):
+            append(v)
+        else:
+            extend(v)
+    return values
+
+
+def message_values(arr, path, required=False):
+    # the value of one key in each of a list of messages, or MISSING where a
+    # message doesn't have it (raising KeyError instead if required=True),
+    # and whether any of the values are lists
+    values = []
+    append = values.append
+    lists = False
+    for obj in arr:
+        v = obj
+        try:
+            for k in path:
+                v = v[k]
+        except (KeyError, IndexError, TypeError):
+            if required:
+                raise KeyError("key %s not found in this message" %
+                               ("/".join(path)))
+            append(MISSING)
+            continue
+        if not lists and v.__class__ not in SCALARS and is_sequence(v):
+            lists = True
+        append(v)
+    return values, lists
+
+
+def structured_array(arrays):
+    # one numpy structured array with a field for each of a dict of arrays
+    lengths = set(len(a) for a in arrays.values())
+    if len(lengths) > 1:
+        raise ValueError("structured arrays need keys of equal length, not %s" %
+                         ({key: len(a)
+                           for key, a in arrays.items()}))
+
+    sa = np.empty(lengths.pop() if lengths else 0,
+                  dtype=[(key, a.dtype) for key, a in arrays.items()])
+    for key, a in arrays.items():
+        sa[key] = a
+    return sa
+
+
+def retry_after(r):
+    # seconds to wait, if the server asked us to wait, otherwise None
+    # (only the delay-seconds form of Retry-After is supported)
+    try:
+        return float(r.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
 
 
 # Print iterations progress
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decimators thin out messages as they are received, so that only the reduced
+series is kept, e.g.
+
+    expt.collect(60, decimate=10)                      # every 10th message
+    expt.collect(60, decimate=BucketMean(0.01))        # 10ms averages
+    expt.collect(60, decimate=Envelope(0.01, "d"))     # min and max of d
+    expt.collect(60, decimate=LTTB(20, "d"))           # 1 in 20, by shape
+
+    Every(n)              - the first message, then every nth one
+    BucketMean(width)     - the mean of each numeric key over each `width`
+                            seconds of message time, as one new message
+    Envelope(width, key)  - the messages with the lowest and highest `key` in
+                            each `width` seconds, in time order, so peaks
+                            are kept
+    LTTB(n, key)          - one message from every n, chosen by the
+                            Largest-Triangle-Three-Buckets method on `key`
+                            against time, which keeps the shape of a plot;
+                            this is a streaming version, so each choice
+                            only looks one bucket ahead
+
+Times come from the experiment's time_key; messages without one are dropped
+by the time-based decimators. Where a key has a list of values, BucketMean
+averages all of them, and the others use the first. BucketMean always
+averages the time_key, as well as any other keys, which may be nested.
+
+A decimator can be used for more than one collect, and by more than one
+experiment at once (e.g. in Fleet.run), as each collect uses a copy of it.
+
+"""
+import copy
+import math
+
+from practable.keys import compile_key, first_value, is_sequence, lookup
+
+
+class Decimator:
+    # add() takes each message, and returns a list of the messages to keep
+    # so far; flush() returns the rest, once there are no more messages
+
+    def start(self, time_of, separator="/", time_path=None):
+        # called before each run, with a function that returns the time in
+        # a message (raising KeyError if there isn't one), and the compiled
+        # time_key it looks up, if there is one
+        self.separator = separator
+        self.time_of = time_of
+        self.time_path = time_path
+
+    def add(self, message):
+        raise NotImplementedError
+
+    def flush(self):
+        return []
+
+    def run(self, messages):
+        # yield the messages to keep, from an iterable of messages
+        for message in messages:
+            yield from self.add(message)
+        yield from self.flush()
+
+
+class Every(Decimator):
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        self.n = n
+
+    def start(self, time_of, separator="/", time_path=None):
+        super().start(time_of, separator, time_path)
+        self.count = 0
+
+    def add(self, message):
+        self.count += 1
+        if (self.count - 1) % self.n == 0:
+            return [message]
+        return []
+
+
+class TimeBuckets(Decimator):
+    # groups messages into buckets of `width` seconds of message time
+
+    def __init__(self, width, units_per_second=1000):
+        if width <= 0:
+            raise ValueError("width must be more than 0")
+        self.width = width * units_per_second
+
+    def start(self, time_of, separator="/", time_path=None):
+        super().start(time_of, separator, time_path)
+        self.bucket = None
+        self.messages = []
+
+    def add(self, message):
+        try:
+            t = self.time_of(message)
+        except KeyError:
+            return []
+
+        bucket = math.floor(t / self.width)
+        kept = []
+        if bucket != self.bucket:
+            kept = self.flush()
+            self.bucket = bucket
+        self.messages.append(message)
+        return kept
+
+    def flush(self):
+        if len(self.messages) == 0:
+            return []
+        kept = self.reduce(self.messages)
+        self.messages = []
+        return kept
+
+    def reduce(self, messages):
+        # the messages to keep from one bucket
+        raise NotImplementedError
+
+
+class BucketMean(TimeBuckets):
+
+    def __init__(self, width, keys=None, units_per_second=1000):
+        # keys to average, or None for every key with numbers, at any depth
+        super().__init__(width, units_per_second)
+        self.keys = keys
+
+    def reduce(self, messages):
+        if self.keys is None:
+            paths = {}  # as a set that keeps the order the keys are found
+            for message in messages:
+                for path in number_paths(message):
+                    paths[path] = True
+            paths = list(paths)
+        else:
+            paths = [compile_key(key, self.separator) for key in self.keys]
+        if self.time_path is not None and self.time_path not in paths:
+            paths.insert(0, self.time_path)
+
+        mean = {}
+        for path in paths:
+            total = 0
+            count = 0
+            for message in messages:
+                try:
+                    v = lookup(message, path)
+                except KeyError:
+                    continue
+                for x in (v if is_sequence(v) else (v, )):
+                    if is_number(x):
+                        total += x
+                        count += 1
+            if count > 0:
+                put(mean, path, total / count)
+
+        return [mean]
+
+
+class Envelope(TimeBuckets):
+
+    def __init__(self, width, key, units_per_second=1000):
+        super().__init__(width, units_per_second)
+        self.key = key
+
+    def reduce(self, messages):
+        path = compile_key(self.key, self.separator)
+        lowest = highest = None
+        for i, message in enumerate(messages):
+            try:
+                v = lookup(message, path)
+            except KeyError:
+                continue
+            values = [
+                x for x in (v if is_sequence(v) else (v, )) if is_number(x)
+            ]
+            if len(values) == 0:
+                continue
+            if lowest is None or min(values) < lowest[0]:
+                lowest = (min(values), i)
+            if highest is None or max(values) > highest[0]:
+                highest = (max(values), i)
+
+        if lowest is None:
+            return []
+        return [messages[i] for i in sorted(set((lowest[1], highest[1])))]
+
+
+class LTTB(Decimator):
+
+    def __init__(self, n, key):
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        self.key = key
+        self.n = n
+
+    def start(self, time_of, separator="/", time_path=None):
+        super().start(time_of, separator, time_path)
+        self.path = compile_key(self.key, separator)
+        self.previous = None  # (x, y) of the last message kept
+        self.bucket = []  # (x, y, message) to choose from
+        self.next = []  # (x, y, message) in the bucket after that
+
+    def add(self, message):
+        try:
+            point = (self.time_of(message),
+                     first_value(lookup(message, self.path)), message)
+        except KeyError:
+            return []
+        if not is_number(point[1]):
+            return []
+
+        if self.previous is None:  # always keep the first message
+            self.previous = point[:2]
+            return [message]
+
+        if len(self.bucket) < self.n:
+            self.bucket.append(point)
+            return []
+
+        self.next.append(point)
+        if len(self.next) < self.n:
+            return []
+
+        kept = self.choose(mean_point(self.next))
+        self.bucket = self.next
+        self.next = []
+        return [kept]
+
+    def flush(self):
+        # the last bucket is whatever is left, and the last message is kept
+        points = self.bucket + self.next
+        self.bucket = points[:-1]
+        self.next = []
+        kept = []
+        if len(self.bucket) > 0:
+            kept.append(self.choose(points[-1][:2]))
+        if len(points) > 0:
+            kept.append(points[-1][2])
+        self.bucket = []
+        return kept
+
+    def choose(self, following):
+        # the message in self.bucket making the largest triangle with the
+        # last message kept and the following point
+        ax, ay = self.previous
+        cx, cy = following
+        best = max(self.bucket,
+                   key=lambda p: abs((ax - cx) * (p[1] - ay) -
+                                     (ax - p[0]) * (cy - ay)))
+        self.previous = best[:2]
+        return best[2]
+
+
+def is_number(x):
+    # bool is an int, but not a measurement
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def make_decimator(decimate):
+    # a copy of decimate, to start afresh without changing the caller's
+    # one, which may be in use by another thread; an int is shorthand for
+    # Every(n)
+    if isinstance(decimate, Decimator):
+        return copy.copy(decimate)
+    if isinstance(decimate, int):
+        return Every(decimate)
+    raise TypeError("decimate must be an int or a Decimator")
+
+
+def mean_point(points):
+    return (sum(p[0] for p in points) / len(points),
+            sum(p[1] for p in points) / len(points))
+
+
+def number_paths(obj, path=()):
+    # yield the paths to the numbers, or lists starting with a number, in a
+    # message, looking inside nested dicts
+    for key, v in obj.items():
+        if isinstance(v, dict):
+            yield from number_paths(v, path + (key, ))
+        elif is_number(v) or (is_sequence(v) and len(v) > 0
+                              and is_number(v[0])):
+            yield path + (key, )
+
+
+def put(obj, path, value):
+    # set obj[path[0]][path[1]]... = value, making dicts as needed
+    for k in path[:-1]:
+        obj = obj.setdefault(k, {})
+    obj[path[-1]] = value
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decoder turns a frame received from an experiment, which contains one JSON
+message per line, into a list of objects.
+
+The JSON library is chosen by `backend`:
+
+    "auto"    - msgspec if installed, else orjson if installed, else json
+    "msgspec" - https://jcristharif.com/msgspec/
+    "orjson"  - https://github.com/ijl/orjson
+    "json"    - the standard library
+
+Each frame is decoded in one call where possible, rather than line by line.
+Lines that cannot be decoded are skipped and counted in `errors`, with the
+most recent one kept in `last_error`, instead of printing a warning for
+each of them.
+
+"""
+import json
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("auto", "msgspec", "orjson", "json")
+
+
+class Decoder:
+
+    def __init__(self, backend="auto"):
+
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown decoder backend {backend}, valid options are: " +
+                ", ".join(BACKENDS))
+
+        if backend == "auto":
+            if msgspec is not None:
+                backend = "msgspec"
+            elif orjson is not None:
+                backend = "orjson"
+            else:
+                backend = "json"
+
+        if backend == "msgspec":
+            if msgspec is None:
+                raise ImportError("msgspec is not installed")
+            self.lines_decoder = msgspec.json.Decoder()
+            self.loads = self.lines_decoder.decode
+            self.error_types = (msgspec.DecodeError, )
+        elif backend == "orjson":
+            if orjson is None:
+                raise ImportError("orjson is not installed")
+            self.loads = orjson.loads
+            self.error_types = (orjson.JSONDecodeError, )
+        else:
+            self.loads = json.loads
+            self.error_types = (json.JSONDecodeError, )
+
+        self.backend = backend
+        self.errors = 0
+        self.last_error = None
+
+    def __str__(self):
+        return f"{self.backend} decoder ({self.errors} errors)"
+
+    def decode(self, frame):
+
+        if isinstance(frame, (bytes, bytearray)):
+            frame = frame.decode("utf-8", errors="replace")
+
+        lines = [line for line in frame.splitlines() if line.strip() != ""]
+
+        if len(lines) == 0:
+            return []
+
+        if len(lines) > 1:
+            # decode the whole frame at once, and only fall back to decoding
+            # line by line if that fails, e.g. because one line is corrupt
+            # (the length check catches a line that isn't a single value)
+            try:
+                if self.backend == "msgspec":
+                    objs = self.lines_decoder.decode_lines(frame)
+                else:
+                    objs = self.loads("[" + ",".join(lines) + "]")
+                if len(objs) == len(lines):
+                    return objs
+            except self.error_types:
+                pass
+
+        objs = []
+        for line in lines:
+            try:
+                objs.append(self.loads(line))
+            except self.error_types:
+                self.errors += 1
+                self.last_error = line
+        return objs
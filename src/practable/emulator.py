@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emulator is a local stand-in for a practable booking server and the
+experiments it books, for testing and benchmarking offline, e.g.
+
+    with Emulator(experiments=10) as emu:
+        with Experiment(emu.group, "Spinner 3", book_server=emu.book_server,
+                        config_in_cwd=True) as expt:
+            expt.command('{"set":"position","to":2}')
+            messages = expt.collect(1.5)
+
+It serves the parts of the booking API that Booker uses (users, login,
+groups, slots, bookings and activities) and the stream access endpoint,
+and runs a websocket server that sends synthetic spinner telemetry.
+Telemetry sets the message rate, how many messages are sent in each frame,
+timing jitter, dropped messages, and the size and nesting of the messages.
+disconnect() drops every open stream, e.g. to test reconnecting.
+
+It can also be run on its own, with
+
+    python -m practable.emulator --port 8000 --experiments 10
+
+State is kept in memory only, and nothing is authenticated beyond checking
+that tokens were issued by the emulator.
+
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import uuid
+
+from websockets.sync.server import serve as wsserve
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class Telemetry:
+    # generates frames of synthetic spinner messages
+    # rate is messages per second, lines_per_frame is messages per frame
+    # samples_per_message > 1 sends t, d and c as arrays of that length
+    # jitter is the random variation in frame timing, as a fraction of
+    # the frame interval, and drop is the probability a message is lost
+    # padding adds a string of that many characters to each message, and
+    # nesting puts the values that many levels down, e.g. nesting=1 gives
+    # {"data": {"t": ..., }} so the time_key is "data/t"
+
+    def __init__(self,
+                 rate=100,
+                 lines_per_frame=1,
+                 samples_per_message=1,
+                 jitter=0,
+                 drop=0,
+                 padding=0,
+                 nesting=0):
+
+        self.drop = drop
+        self.jitter = jitter
+        self.lines_per_frame = lines_per_frame
+        self.nesting = nesting
+        self.padding = "x" * padding
+        self.rate = rate
+        self.samples_per_message = samples_per_message
+
+    @property
+    def time_key(self):
+        return "/".join(["data"] * self.nesting + ["t"])
+
+    def frames(self, spinner):
+        # yield (seconds to wait, frame) forever
+        interval = self.lines_per_frame / self.rate
+        dt = 1000 / (self.rate * self.samples_per_message)  #ms per sample
+
+        while True:
+            lines = []
+            for i in range(self.lines_per_frame):
+                message = spinner.step(dt, self.samples_per_message)
+                if self.drop > 0 and random.random() < self.drop:
+                    continue
+                if self.padding != "":
+                    message["p"] = self.padding
+                for j in range(self.nesting):
+                    message = {"data": message}
+                lines.append(json.dumps(message))
+
+            wait = interval
+            if self.jitter > 0:
+                wait *= 1 + random.uniform(-self.jitter, self.jitter)
+
+            yield wait, "\n".join(lines)
+
+
+class Spinner:
+    # a first order model of a spinner under position or speed control
+
+    def __init__(self, time_constant=0.2):
+        self.c = 0  # set point
+        self.d = 0  # position
+        self.disconnected = None  # time.monotonic() when last disconnected
+        self.mode = "stop"
+        self.t = 0  # ms
+        self.time_constant = time_constant
+
+    def command(self, message):
+        try:
+            command = json.loads(message)
+        except json.JSONDecodeError:
+            return
+        if command.get("set") == "mode":
+            self.mode = command.get("to", self.mode)
+        elif command.get("set") in ("position", "speed"):
+            self.c = float(command.get("to", self.c))
+
+    def step(self, dt, samples):
+        ts, ds, cs = [], [], []
+        for i in range(samples):
+            self.t += dt
+            if self.mode != "stop":
+                self.d += (self.c - self.d) * dt / 1000 / self.time_constant
+            ts.append(round(self.t))
+            ds.append(self.d)
+            cs.append(self.c)
+        if samples == 1:
+            return {"t": ts[0], "d": ds[0], "c": cs[0]}
+        return {"t": ts, "d": ds, "c": cs}
+
+
+class Emulator:
+
+    def __init__(self,
+                 experiments=10,
+                 group="g-emulator",
+                 name="Spinner %d",
+                 host="localhost",
+                 port=0,
+                 ws_port=0,
+                 telemetry=None,
+                 login_lifetime=timedelta(hours=1)):
+
+        self.group = group
+        self.host = host
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.login_lifetime = login_lifetime
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+
+        # experiments are named e.g. "Spinner 1", and each has one slot
+        slots = {}
+        for i in range(1, experiments + 1):
+            slots["sl-emulator-%03d" % (i)] = {
+                "description": {
+                    "name": name % (i),
+                    "type": "slot",
+                },
+                "policy": "p-emulator",
+            }
+
+        self.groups = {
+            group: {
+                "description": {
+                    "name": group,
+                    "type": "group",
+                },
+                "policies": {
+                    "p-emulator": {
+                        "description": {
+                            "name": "emulator",
+                            "type": "policy",
+                        },
+                        "slots": slots,
+                    }
+                },
+            }
+        }
+
+        self.bookings = {}  # name: booking
+        self.connections = set()  # open stream websockets
+        self.spinners = {}  # booking name: Spinner, kept between connections
+        self.streams = {}  # stream id: (booking name, token)
+        self.tokens = {}  # login token: user name
+        self.users = set()
+
+        handler = type("Handler", (RequestHandler, ), {"emulator": self})
+        self.http = ThreadingHTTPServer((host, port), handler)
+        self.ws = wsserve(self.handle_stream, host, ws_port)
+        self.threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def book_server(self):
+        return "http://%s:%d/book" % (self.host, self.http.server_port)
+
+    @property
+    def ws_server(self):
+        return "ws://%s:%d" % (self.host, self.ws.socket.getsockname()[1])
+
+    def start(self):
+        for target in (self.http.serve_forever, self.ws.serve_forever):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.http.shutdown()
+        self.ws.shutdown()
+        self.http.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def disconnect(self):
+        # drop every open stream, e.g. to test reconnecting
+        with self.lock:
+            connections = list(self.connections)
+        for websocket in connections:
+            websocket.close(1011, "dropped by emulator")
+
+    def slot_name(self, slot):
+        for gd in self.groups.values():
+            for policy in gd["policies"].values():
+                if slot in policy["slots"]:
+                    return policy["slots"][slot]["description"]["name"]
+        return None
+
+    def slot_bookings(self, slot):
+        return [b for b in self.bookings.values() if b["slot"] == slot]
+
+    def handle_stream(self, websocket):
+        # send telemetry for the experiment booked under this stream id,
+        # applying any commands received, until the booking ends
+        stream_id = urlparse(websocket.request.path).path.strip("/")
+
+        with self.lock:
+            try:
+                booking_name, token = self.streams[stream_id]
+            except KeyError:
+                websocket.close(1008, "unknown stream")
+                return
+
+        # the spinner carries on while nobody is connected, as a real one
+        # would, so its time moves on by however long that was
+        with self.lock:
+            spinner = self.spinners.setdefault(booking_name, Spinner())
+            self.connections.add(websocket)
+        if spinner.disconnected is not None:
+            spinner.t += (time.monotonic() - spinner.disconnected) * 1000
+        try:
+            self.send_telemetry(websocket, booking_name, spinner)
+        finally:
+            spinner.disconnected = time.monotonic()
+            with self.lock:
+                self.connections.discard(websocket)
+
+    def send_telemetry(self, websocket, booking_name, spinner):
+        deadline = time.monotonic()
+
+        for wait, frame in self.telemetry.frames(spinner):
+            booking = self.bookings.get(booking_name)
+            if booking is None or datetime.now(timezone.utc) > booking["end"]:
+                websocket.close(1000, "booking ended")
+                return
+
+            # wait until the frame is due, handling commands meanwhile
+            deadline += wait
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    spinner.command(websocket.recv(timeout=remaining))
+                except TimeoutError:
+                    break
+                except Exception:
+                    return  # connection closed
+
+            if frame == "":
+                continue  # every message in the frame was dropped
+            try:
+                websocket.send(frame)
+            except Exception:
+                return  # connection closed
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # routes requests to the emulated booking API
+    # the emulator is set as a class attribute by Emulator
+
+    emulator = None
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def reply(self, status, body=None, headers=None):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if status != 304:
+            self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self, method):
+        # discard any request body, so the connection can be reused
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            self.rfile.read(length)
+
+        u = urlparse(self.path)
+        parts = u.path.strip("/").split("/")
+        query = {k: v[0] for k, v in parse_qs(u.query).items()}
+        emu = self.emulator
+
+        # stream access is not under the booking server path
+        if parts[0] == "access" and len(parts) == 2 and method == "POST":
+            return self.access(parts[1])
+
+        if parts[:3] != ["book", "api", "v1"]:
+            return self.reply(404, {"error": "not found"})
+        parts = parts[3:]
+
+        with emu.lock:
+            if parts[:2] == ["users", "unique"] and method == "POST":
+                user = "cemu-" + uuid.uuid4().hex[:16]
+                emu.users.add(user)
+                return self.reply(200, {"user_name": user})
+
+            if parts[0] == "login" and len(parts) == 2 and method == "POST":
+                token = uuid.uuid4().hex
+                emu.tokens[token] = parts[1]
+                emu.users.add(parts[1])
+                exp = datetime.now(timezone.utc) + emu.login_lifetime
+                return self.reply(200, {
+                    "token": token,
+                    "exp": int(exp.timestamp())
+                })
+
+            if self.headers.get("Authorization") not in emu.tokens:
+                return self.reply(401, {"error": "not logged in"})
+
+            if parts[0] == "groups" and len(parts) == 2 and method == "GET":
+                return self.group(parts[1])
+
+            if parts[0] == "slots" and len(parts) == 2:
+                if method == "GET":
+                    return self.slot(parts[1])
+                if method == "POST":
+                    return self.book(parts[1], query)
+
+            if parts[0] == "users" and len(parts) >= 3:
+                user = parts[1]
+                if parts[2] == "groups" and len(parts) == 4:
+                    if parts[3] in emu.groups:
+                        return self.reply(204)
+                    return self.reply(404, {"error": "group not found"})
+                if parts[2] == "bookings" and len(parts) == 3:
+                    return self.reply(200, [
+                        self.booking_json(b)
+                        for b in emu.bookings.values() if b["user"] == user
+                    ])
+                if parts[2] == "bookings" and len(parts) == 4:
+                    if method == "PUT":
+                        return self.activity(user, parts[3])
+                    if method == "DELETE":
+                        return self.cancel(user, parts[3])
+
+        return self.reply(404, {"error": "not found"})
+
+    def access(self, stream_id):
+        emu = self.emulator
+        with emu.lock:
+            try:
+                booking_name, token = emu.streams[stream_id]
+            except KeyError:
+                return self.reply(404, {"error": "stream not found"})
+        if self.headers.get("Authorization") != token:
+            return self.reply(401, {"error": "wrong token"})
+        return self.reply(200, {"uri": emu.ws_server + "/" + stream_id})
+
+    def activity(self, user, name):
+        emu = self.emulator
+        booking = emu.bookings.get(name)
+        now = datetime.now(timezone.utc)
+        if booking is None or booking["user"] != user:
+            return self.reply(404, {"error": "booking not found"})
+        if not booking["start"] <= now <= booking["end"]:
+            return self.reply(400, {"error": "booking not current"})
+
+        stream_id = uuid.uuid4().hex
+        token = uuid.uuid4().hex
+        emu.streams[stream_id] = (name, token)
+        host, port = self.server.server_address[:2]
+
+        return self.reply(
+            200, {
+                "description": {
+                    "name": emu.slot_name(booking["slot"]),
+                    "type": "activity",
+                },
+                "exp":
+                int(booking["end"].timestamp()),
+                "streams": [{
+                    "for": "data",
+                    "token": token,
+                    "url": "http://%s:%d/access/%s" %
+                    (emu.host, port, stream_id),
+                }],
+            })
+
+    def book(self, slot, query):
+        emu = self.emulator
+        if emu.slot_name(slot) is None:
+            return self.reply(404, {"error": "slot not found"})
+        try:
+            start = datetime.fromisoformat(query["from"])
+            end = datetime.fromisoformat(query["to"])
+            user = query["user_name"]
+        except (KeyError, ValueError):
+            return self.reply(400, {"error": "need user_name, from and to"})
+
+        for b in emu.slot_bookings(slot):
+            if start < b["end"] and end > b["start"]:
+                return self.reply(409, {"error": "slot not available"})
+
+        name = str(uuid.uuid4())
+        emu.bookings[name] = {
+            "end": end,
+            "name": name,
+            "slot": slot,
+            "start": start,
+            "user": user,
+        }
+        return self.reply(204)
+
+    def booking_json(self, booking):
+        return {
+            "name": booking["name"],
+            "slot": booking["slot"],
+            "user": booking["user"],
+            "when": {
+                "start": booking["start"].strftime(TIME_FORMAT),
+                "end": booking["end"].strftime(TIME_FORMAT),
+            },
+        }
+
+    def cancel(self, user, name):
+        emu = self.emulator
+        booking = emu.bookings.get(name)
+        if booking is None or booking["user"] != user:
+            return self.reply(500, {"error": "can't cancel booking"})
+        # end the booking now, so that any stream for it closes
+        del emu.bookings[name]
+        # the booking server replies 404 once a booking is cancelled
+        return self.reply(404, {"error": "booking cancelled"})
+
+    def group(self, group):
+        # supports conditional requests, like the booking server's proxy
+        emu = self.emulator
+        try:
+            gd = emu.groups[group]
+        except KeyError:
+            return self.reply(404, {"error": "group not found"})
+        etag = '"%s"' % (hashlib.sha1(
+            json.dumps(gd, sort_keys=True).encode("utf-8")).hexdigest())
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(emu.started, usegmt=True),
+        }
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304, headers=headers)
+        return self.reply(200, gd, headers=headers)
+
+    def slot(self, slot):
+        # the next free period in the slot, starting now if it is free
+        emu = self.emulator
+        if emu.slot_name(slot) is None:
+            return self.reply(404, {"error": "slot not found"})
+        now = datetime.now(timezone.utc)
+        start = now
+        for b in sorted(emu.slot_bookings(slot), key=lambda b: b["start"]):
+            if b["start"] <= start < b["end"]:
+                start = b["end"]
+        end = start + timedelta(days=1)
+        return self.reply(200, [{
+            "start": start.strftime(TIME_FORMAT),
+            "end": end.strftime(TIME_FORMAT),
+        }])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in for a practable booking server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ws-port", type=int, default=8001)
+    parser.add_argument("--experiments", type=int, default=10)
+    parser.add_argument("--group", default="g-emulator")
+    parser.add_argument("--rate", type=float, default=100)
+    parser.add_argument("--lines-per-frame", type=int, default=1)
+    parser.add_argument("--samples-per-message", type=int, default=1)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--drop", type=float, default=0)
+    args = parser.parse_args()
+
+    telemetry = Telemetry(rate=args.rate,
+                          lines_per_frame=args.lines_per_frame,
+                          samples_per_message=args.samples_per_message,
+                          jitter=args.jitter,
+                          drop=args.drop)
+
+    with Emulator(experiments=args.experiments,
+                  group=args.group,
+                  host=args.host,
+                  port=args.port,
+                  ws_port=args.ws_port,
+                  telemetry=telemetry) as emu:
+        print(f"Booking server {emu.book_server} group {emu.group}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fleet books and connects to many experiments at once, for testing a whole
+group of them, e.g. a health check of every spinner:
+
+    def check(expt):
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.command('{"set":"position","to":2}', verbose=False)
+        messages = expt.collect(2, verbose=False)
+        return expt.extract_series(messages, "d")[-1]
+
+    with Fleet('g-open-x3fca8', 'Spinner', count=20) as fleet:
+        results = fleet.run(check)
+
+All the experiments share one Booker, so there is one login, one download
+of the group details and one fetch of the activities. Bookings, stream
+connections and run() all happen in parallel, on up to `workers` threads.
+
+Only the bookings that the Fleet made are cancelled on exit, so other
+bookings held by the same user are left alone.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from practable.core import Booker, Experiment
+from practable.trace import carry, span
+
+
+class Fleet:
+
+    def __init__(self,
+                 group,
+                 name,
+                 count=None,
+                 number="",
+                 match="substring",
+                 book_server="",
+                 config_in_cwd=False,
+                 duration=timedelta(minutes=3),
+                 workers=16,
+                 verbose=True,
+                 **kwargs):
+        # count is the most experiments to book, or None for all of the
+        # matching experiments that are available
+        # name, number and match select experiments as for
+        # Booker.filter_experiments; other arguments are passed on to
+        # each Experiment, e.g. time_key or background
+
+        self.book_server = book_server
+        self.booker = None
+        self.booked = []  # names of the experiments booked by this fleet
+        self.bookings = {}  # name: booking made by this fleet
+        self.config_in_cwd = config_in_cwd
+        self.count = count
+        self.duration = duration
+        self.experiments = {}  # name: Experiment
+        self.group = group
+        self.kwargs = kwargs
+        self.match = match
+        self.name = name
+        self.number = number
+        # a Tracer, which is also passed on to each Experiment
+        self.tracer = kwargs.get("tracer")
+        self.verbose = verbose
+        self.workers = workers
+
+    def __enter__(self):
+
+        metrics = self.kwargs.get("metrics")
+        # one pooled connection per worker, so that none of them waits for
+        # another's connection to the booking server to be free
+        if self.book_server == "":
+            self.booker = Booker(config_in_cwd=self.config_in_cwd,
+                                 pool_size=self.workers,
+                                 metrics=metrics,
+                                 tracer=self.tracer)
+        else:
+            self.booker = Booker(book_server=self.book_server,
+                                 config_in_cwd=self.config_in_cwd,
+                                 pool_size=self.workers,
+                                 metrics=metrics,
+                                 tracer=self.tracer)
+
+        try:
+            with span(self.tracer,
+                      "enter",
+                      group=self.group,
+                      fleet=self.name):
+                self.enter()
+        except BaseException:
+            self.__exit__()
+            raise
+
+        return self
+
+    def enter(self):
+        # each phase has a span, so a Tracer shows where the time goes, with
+        # the work done on the worker threads nested within its phase
+        tracer = self.tracer
+
+        with span(tracer, "add_group"):
+            self.booker.add_group(self.group)
+        with span(tracer, "get_group_details"):
+            self.booker.get_group_details()
+        with span(tracer, "filter_experiments"):
+            self.booker.filter_experiments(self.name,
+                                           self.number,
+                                           match=self.match,
+                                           group=self.group,
+                                           workers=self.workers,
+                                           first=self.count)
+
+        selected = self.booker.available
+        if self.count is not None:
+            selected = selected[:self.count]
+
+        if len(selected) == 0:
+            raise Exception("There are no available experiments matching `%s`" %
+                            (self.name))
+
+        # another user may book an experiment before we do, so carry on
+        # with the ones we can book
+        booked = []
+        with span(tracer, "book") as s:
+            for name, error in zip(selected, self.map(self.book, selected)):
+                if error is None:
+                    booked.append(name)
+                elif self.verbose:
+                    print("Could not book %s: %s" % (name, error))
+            s.set("booked", len(booked))
+
+        with span(tracer, "get_bookings"):
+            self.booker.get_bookings()
+            self.find_bookings()
+        with span(tracer, "get_all_activities"):
+            self.booker.get_all_activities(names=booked)
+
+        for name in booked:
+            self.experiments[name] = Experiment(self.group,
+                                                name,
+                                                booker=self.booker,
+                                                **self.kwargs)
+
+        experiments = list(self.experiments.values())
+        with span(tracer, "open"):
+            for expt, error in zip(experiments,
+                                   self.map(self.open, experiments)):
+                if error is not None:
+                    del self.experiments[expt.name]
+                    if self.verbose:
+                        print("Could not connect to %s: %s" %
+                              (expt.name, error))
+
+        if self.verbose:
+            print("Connected to %d experiments" % (len(self.experiments)))
+
+    def __exit__(self, *args):
+        self.map(self.close, list(self.experiments.values()))
+        if any(name not in self.bookings for name in self.booked):
+            # e.g. __enter__ failed before finding them
+            try:
+                self.booker.get_bookings()
+                self.find_bookings()
+            except Exception as e:
+                if self.verbose:
+                    print("Could not find the bookings to cancel: %s" % (e))
+        self.map(self.cancel, list(self.bookings.values()))
+        self.experiments = {}
+        self.booked = []
+        self.bookings = {}
+        self.booker.close()
+
+    def __iter__(self):
+        return iter(self.experiments.values())
+
+    def __len__(self):
+        return len(self.experiments)
+
+    def book(self, name):
+        # returns the exception, if the booking failed
+        try:
+            self.booker.book(self.duration, selected=name)
+        except Exception as e:
+            return e
+        # recorded straight away, so that it is cancelled on exit even if
+        # something fails before its booking is found
+        self.booked.append(name)
+
+    def cancel(self, booking):
+        try:
+            self.booker.cancel_booking(booking)
+        except Exception as e:
+            if self.verbose:
+                print("Could not cancel booking %s: %s" % (booking, e))
+
+    def find_bookings(self):
+        # the names of our bookings, from their slots, as the booking
+        # server doesn't return them when booking
+        for name in self.booked:
+            slot = self.booker.experiment_details[name]["slot"]
+            for booking in self.booker.bookings:
+                if booking["slot"] == slot:
+                    self.bookings[name] = booking["name"]
+
+    def close(self, expt):
+        try:
+            expt.__exit__()
+        except Exception as e:
+            if self.verbose:
+                print("Could not close %s: %s" % (expt.name, e))
+
+    def map(self, fn, items):
+        # call fn on each item in parallel, returning the results in order
+        if len(items) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers,
+                                                len(items))) as executor:
+            return list(
+                executor.map(carry(self.tracer, fn), items))
+
+    def open(self, expt):
+        # returns the exception, if the connection failed
+        try:
+            expt.open(self.booker.connect(expt.name))
+        except Exception as e:
+            return e
+
+    def run(self, fn):
+        # call fn(expt) for every experiment in parallel, returning a dict
+        # of name: result, where result is the exception if fn raised one,
+        # so that one failing experiment doesn't stop the others
+        def call(expt):
+            try:
+                return fn(expt)
+            except Exception as e:
+                return e
+
+        experiments = list(self.experiments.values())
+        results = self.map(call, experiments)
+        return {expt.name: result for expt, result in zip(experiments, results)}
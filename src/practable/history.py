@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+History keeps the messages received over a recent period, indexed by the
+time in each message, so that windows of them can be looked up without
+collecting again, e.g. with Experiment(..., retention=60, background=True)
+
+    expt.command('{"set":"position","to":2}')
+    time.sleep(5)
+    step = expt.since('{"set":"position","to":2}')   # the response
+    recent = expt.last(0.5)                           # the last 500ms
+    window = expt.window(10000, 12000)                # t from 10s to 12s
+
+Messages are kept whether or not they have been collected, and are
+dropped once they are more than `retention` seconds older than the newest
+message. Each message is indexed by its first time value (so a message
+with an array of times is in the window containing the first of them).
+Messages without a time are not kept.
+
+Times are in the units of the messages (e.g. ms), except for retention and
+last(), which are in seconds like collect(). Lookups are binary searches,
+and adding messages takes constant time as long as they arrive in time
+order.
+
+"""
+import bisect
+import threading
+
+
+class History:
+
+    def __init__(self, time_of, retention=60, units_per_second=1000):
+        # time_of(message) returns the time in a message, raising KeyError
+        # if there isn't one; retention is in seconds, or None to keep
+        # everything
+
+        self.lock = threading.Lock()
+        self.marks = []  # (label, time of the newest message when marked)
+        self.messages = []
+        self.retention = retention
+        self.start = 0  # index of the oldest message still kept
+        self.time_of = time_of
+        self.times = []  # sorted, for each message
+        self.units_per_second = units_per_second
+        self.untimed = 0  # messages not kept because they had no time
+
+    def __len__(self):
+        return len(self.times) - self.start
+
+    def add(self, messages):
+        with self.lock:
+            for message in messages:
+                try:
+                    t = self.time_of(message)
+                except KeyError:
+                    self.untimed += 1
+                    continue
+
+                if len(self.times) == self.start or t >= self.times[-1]:
+                    self.times.append(t)
+                    self.messages.append(message)
+                else:  # out of order, which should be rare
+                    i = bisect.bisect_right(self.times, t, self.start)
+                    self.times.insert(i, t)
+                    self.messages.insert(i, message)
+
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.marks = []
+            self.messages = []
+            self.start = 0
+            self.times = []
+
+    def evict(self):
+        # must be called with self.lock held
+        if self.retention is None or len(self.times) == self.start:
+            return
+
+        oldest = self.times[-1] - self.retention * self.units_per_second
+        self.start = bisect.bisect_left(self.times, oldest, self.start)
+        self.marks = [(label, t) for label, t in self.marks
+                      if t is None or t >= oldest]
+
+        # drop evicted messages in batches, rather than one at a time from
+        # the front of the lists, which would be slow
+        if self.start > 1000 and self.start > len(self.times) // 2:
+            del self.times[:self.start]
+            del self.messages[:self.start]
+            self.start = 0
+
+    def last(self, duration):
+        # messages from the last `duration` seconds, up to the newest message
+        with self.lock:
+            if len(self.times) == self.start:
+                return []
+            oldest = self.times[-1] - duration * self.units_per_second
+            i = bisect.bisect_left(self.times, oldest, self.start)
+            return self.messages[i:]
+
+    def latest(self):
+        # time of the newest message, or None if there are none
+        with self.lock:
+            if len(self.times) == self.start:
+                return None
+            return self.times[-1]
+
+    def mark(self, label):
+        # remember the time of the newest message, e.g. when a command is sent
+        with self.lock:
+            t = None
+            if len(self.times) > self.start:
+                t = self.times[-1]
+            self.marks.append((label, t))
+
+    def since(self, label=None):
+        # messages newer than the most recent mark with this label, or the
+        # most recent mark of all if label is None
+        with self.lock:
+            for mark, t in reversed(self.marks):
+                if label is None or mark == label:
+                    break
+            else:
+                raise KeyError("%s not found in history" % (label))
+
+            i = self.start
+            if t is not None:
+                i = bisect.bisect_right(self.times, t, self.start)
+            return self.messages[i:]
+
+    def window(self, start=None, end=None):
+        # messages with start <= time < end, where None means no limit
+        with self.lock:
+            i = self.start
+            j = len(self.times)
+            if start is not None:
+                i = bisect.bisect_left(self.times, start, self.start)
+            if end is not None:
+                j = bisect.bisect_left(self.times, end, self.start)
+            return self.messages[i:j]
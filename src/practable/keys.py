@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keys pick values out of messages, e.g. "data/time" for message["data"]["time"].
+A key is compiled into a path once, and then looked up in many messages.
+
+"""
+import collections.abc
+
+
+def compile_key(key, separator="/"):
+    # split a key such as "data/time" into the path ("data", "time")
+    # once, so that it can be looked up in many messages
+    return tuple(key.split(separator))
+
+
+def first_value(v):
+    # the first of a list of values, or a single value
+    if is_sequence(v):
+        return v[0]
+    return v
+
+
+def is_sequence(v):
+    # time and data values may be single values or lists of them
+    return isinstance(v, collections.abc.Sequence) and not isinstance(v, str)
+
+
+def lookup(obj, path):
+    # follow a compiled key path down into a message
+    v = obj
+    try:
+        for k in path:
+            v = v[k]
+    except (KeyError, IndexError, TypeError):
+        raise KeyError("key %s not found in this message" % ("/".join(path)))
+    return v
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metrics collects counters, gauges and histograms about where the time goes
+when using the booking server and the experiments. It is opt-in, e.g.
+
+    metrics = Metrics()
+    with Experiment('g-open-x3fca8', 'Spinner 51 (Open Days)',
+                    metrics=metrics) as expt:
+        ...
+    print(metrics.prometheus())   # Prometheus text format
+    metrics.as_dict()             # or a dict, e.g. to save as JSON
+
+One Metrics can be shared by many Experiments (e.g. a Fleet), as each
+Experiment's metrics are labelled with its name. hook(kind, name, value,
+labels) is called with every update, e.g. to forward them to another
+monitoring system; it is called on the thread making the update, so it
+should be quick.
+
+Booker records
+
+    http_requests_total{method, endpoint, status}   counter
+    http_request_seconds{method, endpoint}          histogram, per attempt
+    http_retries_total{method, endpoint}            counter
+
+Experiment records
+
+    frames_total, messages_total, bytes_total       counters
+    decode_seconds                                  histogram, per frame
+    stash_depth                                     gauge
+    time_key_lag_current_seconds                    gauge
+    time_key_lag_seconds                            histogram
+    command_response_seconds                        histogram
+    command_ack_seconds                             histogram
+
+command_response_seconds is from sending a command to the next frame
+received, and command_ack_seconds is from sending a command to receiving
+its acknowledgement (see Experiment.command). time_key_lag_seconds is how
+far the time in the messages has fallen behind the local clock, compared
+with the least it has been behind so far, so it grows if messages are
+queueing up somewhere between the experiment and here;
+time_key_lag_current_seconds is its latest value.
+
+Label values are kept as strings, as they are in the exposition format,
+so e.g. an HTTP status of 200 and "timeout" can be labels of one counter.
+
+"""
+import bisect
+import math
+import threading
+import time
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last is +Inf
+        self.count = 0
+        self.max = None
+        self.min = None
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "buckets": dict(zip(self.buckets + (math.inf, ), self.counts)),
+        }
+
+
+class Metrics:
+
+    def __init__(self, hook=None, buckets=BUCKETS):
+
+        self.buckets = buckets
+        self.counters = {}  # (name, labels): value
+        self.gauges = {}  # (name, labels): value
+        self.histograms = {}  # (name, labels): Histogram
+        self.hook = hook
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.hook is not None:
+            self.hook("counter", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = label_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+        if self.hook is not None:
+            self.hook("histogram", name, value, labels)
+
+    def set(self, name, value, **labels):
+        key = label_key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+        if self.hook is not None:
+            self.hook("gauge", name, value, labels)
+
+    def as_dict(self):
+        # {"counters": {name: [{"labels": {...}, "value": v, "rate": v/s}]},
+        #  "gauges": ..., "histograms": ..., "uptime_seconds": s}
+        uptime = time.monotonic() - self.started
+        result = {
+            "uptime_seconds": uptime,
+            "counters": {},
+            "gauges": {},
+            "histograms": {}
+        }
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                result["counters"].setdefault(name, []).append({
+                    "labels": dict(labels),
+                    "value": value,
+                    "rate": value / uptime if uptime > 0 else None,
+                })
+            for (name, labels), value in sorted(self.gauges.items()):
+                result["gauges"].setdefault(name, []).append({
+                    "labels": dict(labels),
+                    "value": value
+                })
+            for (name, labels), h in sorted(self.histograms.items(),
+                                            key=lambda item: item[0]):
+                entry = h.as_dict()
+                entry["labels"] = dict(labels)
+                result["histograms"].setdefault(name, []).append(entry)
+        return result
+
+    def prometheus(self, prefix="practable_"):
+        # the metrics in the Prometheus text exposition format
+        lines = []
+        with self.lock:
+            for kind, metrics in (("counter", self.counters), ("gauge",
+                                                               self.gauges)):
+                for name in sorted(set(name for name, labels in metrics)):
+                    lines.append("# TYPE %s%s %s" % (prefix, name, kind))
+                    for (n, labels), value in sorted(metrics.items()):
+                        if n == name:
+                            lines.append("%s%s%s %s" %
+                                         (prefix, name, format_labels(labels),
+                                          format_value(value)))
+
+            for name in sorted(set(name for name, labels in self.histograms)):
+                lines.append("# TYPE %s%s histogram" % (prefix, name))
+                for (n, labels), h in sorted(self.histograms.items(),
+                                             key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for le, count in zip(h.buckets + (math.inf, ), h.counts):
+                        cumulative += count
+                        lines.append(
+                            "%s%s_bucket%s %d" %
+                            (prefix, name,
+                             format_labels(labels +
+                                           (("le", format_value(le)), )),
+                             cumulative))
+                    lines.append("%s%s_sum%s %s" %
+                                 (prefix, name, format_labels(labels),
+                                  format_value(h.sum)))
+                    lines.append("%s%s_count%s %d" %
+                                 (prefix, name, format_labels(labels),
+                                  h.count))
+
+        return "\n".join(lines) + "\n"
+
+
+def label_key(name, labels):
+    # labels are sorted so that the key doesn't depend on their order, and
+    # stringified so that keys with different types of value can be sorted
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace(
+        '"', '\\"').replace("\n", "\\n")) for k, v in labels) + "}"
+
+
+def format_value(v):
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recorder writes the frames received from an experiment straight to disk,
+and Recording reads them back, e.g.
+
+    with Experiment('g-open-x3fca8', 'Spinner 51 (Open Days)') as expt:
+        expt.record("run.log")
+        expt.collect(60)
+
+    with ReplayExperiment("run.log") as expt:
+        messages = expt.collect(60)   # same messages as before
+
+The file is an append-only log of compressed chunks. Each chunk holds the
+raw frames received over a second or so (or up to `chunk_bytes` of them),
+each with the local time.time() at which it was received, so it can be
+read back even if the recording was interrupted part way through a chunk.
+
+    file  = MAGIC chunk*
+    chunk = "CHNK" frames(uint32) raw_length(uint32) compressed_length(uint32)
+            zlib(record*)
+    record = received(float64) length(uint32) frame(utf-8)
+
+(all little-endian). Recorder replaces an existing file, unless
+append=True, when it adds chunks to the end of it. Frames are compressed on a writer thread, so that
+recording does not hold up receiving. Recording memory-maps the file, and
+only decompresses one chunk at a time.
+
+"""
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"PRACTABLE-LOG-1\n"
+CHUNK_HEADER = struct.Struct("<4sIII")
+RECORD_HEADER = struct.Struct("<dI")
+
+
+class Recorder:
+
+    def __init__(self,
+                 path,
+                 chunk_bytes=1000000,
+                 flush_interval=1.0,
+                 level=6,
+                 append=False):
+
+        self.chunk_bytes = chunk_bytes
+        self.closed = False
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self.level = level
+        self.path = path
+        self.queue = queue.Queue()
+
+        # an existing recording is replaced, unless append=True, when the
+        # new chunks are added after those already in it
+        self.file = open(path, "ab" if append else "wb")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+        self.writer = threading.Thread(target=self.write_loop,
+                                       name="practable-recorder",
+                                       daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # write any remaining frames and close the file
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+
+    def write(self, frame, received=None):
+        # queue a frame for writing, without waiting for it to be written
+        if self.closed:
+            return
+        if received is None:
+            received = time.time()
+        if isinstance(frame, str):
+            frame = frame.encode("utf-8")
+        self.queue.put((received, frame))
+        self.frames += 1
+
+    def write_chunk(self, records, raw_length):
+        payload = zlib.compress(b"".join(records), self.level)
+        self.file.write(
+            CHUNK_HEADER.pack(b"CHNK",
+                              len(records) // 2, raw_length, len(payload)))
+        self.file.write(payload)
+        self.file.flush()
+
+    def write_loop(self):
+        # runs in the writer thread
+        records = []
+        raw_length = 0
+        last = time.monotonic()
+        stop = False
+
+        while not stop:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    received, frame = item
+                    records.append(RECORD_HEADER.pack(received, len(frame)))
+                    records.append(frame)
+                    raw_length += RECORD_HEADER.size + len(frame)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if len(records) > 0 and (stop or raw_length >= self.chunk_bytes
+                                     or now - last >= self.flush_interval):
+                self.write_chunk(records, raw_length)
+                records = []
+                raw_length = 0
+                last = now
+
+        self.file.close()
+
+
+class Recording:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.chunks = []  # (offset, frames, raw_length, compressed_length)
+        self.data = None
+        self.file = open(path, "rb")
+
+        if os.fstat(self.file.fileno()).st_size == 0:
+            raise ValueError("%s is empty" % (path))
+
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a practable recording" % (path))
+
+        # index the chunks, ignoring an incomplete one at the end
+        offset = len(MAGIC)
+        while offset + CHUNK_HEADER.size <= len(self.data):
+            tag, frames, raw_length, compressed_length = CHUNK_HEADER.unpack_from(
+                self.data, offset)
+            start = offset + CHUNK_HEADER.size
+            if tag != b"CHNK" or start + compressed_length > len(self.data):
+                break
+            self.chunks.append((start, frames, raw_length, compressed_length))
+            offset = start + compressed_length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        # number of frames
+        return sum(chunk[1] for chunk in self.chunks)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def frames(self):
+        # yield (received, frame) for each frame, in the order received
+        for start, frames, raw_length, compressed_length in self.chunks:
+            raw = zlib.decompress(self.data[start:start + compressed_length])
+            offset = 0
+            while offset < len(raw):
+                received, length = RECORD_HEADER.unpack_from(raw, offset)
+                offset += RECORD_HEADER.size
+                yield received, raw[offset:offset + length].decode("utf-8")
+                offset += length
+
+    def messages(self, decoder):
+        # yield each decoded message, using a Decoder
+        for received, frame in self.frames():
+            yield from decoder.decode(frame)
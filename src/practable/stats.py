@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+StreamStats keeps running statistics of some keys in the messages, as they
+arrive, without keeping the messages themselves, e.g. for a soak test
+
+    stats = expt.summarize(3600, ["d", "c"], bucket=60)
+    stats.summaries["d"].mean          # over the whole hour
+    stats.buckets[60000]["d"].max      # over the second minute (t in ms)
+
+Each Summary has the count, mean, variance, std, min and max (updated with
+Welford's algorithm, so it stays accurate over long runs), and estimates of
+some quantiles, using the P-square algorithm (Jain and Chlamtac, 1985),
+which keeps five numbers per quantile rather than all the values. The
+quantile estimates are exact for the first five values, and usually within
+a few percent of the spread of the values after that.
+
+Values may be single numbers or lists of them. Messages without a key, and
+values that aren't numbers, are skipped.
+
+With `bucket` (in seconds of message time), there is also a Summary for
+each bucket, keyed by the time at which the bucket starts, in the units of
+the messages. on_bucket(start, summaries) is called as each bucket is
+completed, i.e. when the first message of the next bucket arrives, and for
+the last bucket when finish() is called (summarize() does this). With
+keep_buckets=False, each bucket is dropped once on_bucket has had it, so
+that memory does not grow with the length of the run.
+
+"""
+import math
+
+from practable.keys import compile_key, is_sequence, lookup
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class P2Quantile:
+
+    def __init__(self, p):
+
+        if not 0 < p < 1:
+            raise ValueError("p must be between 0 and 1")
+
+        self.count = 0
+        self.heights = []
+        # actual and desired positions of the markers, and how much the
+        # desired positions move with each value
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        self.p = p
+
+    @property
+    def value(self):
+        # the estimate, or None if there have been no values
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            values = sorted(self.heights)
+            return values[min(len(values) - 1, int(self.p * len(values)))]
+        return self.heights[2]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1
+                                                    and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) /
+                    (n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) *
+                    (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < h < q[i + 1]:
+                    # the parabola overshot, so interpolate linearly instead
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+
+class Summary:
+
+    def __init__(self, quantiles=QUANTILES):
+
+        self.count = 0
+        self.estimators = [P2Quantile(p) for p in quantiles]
+        self.max = None
+        self.mean = None
+        self.min = None
+        self.m2 = 0  # sum of squared differences from the mean
+
+    def __repr__(self):
+        return "Summary(%s)" % (", ".join(
+            "%s=%s" % (k, v) for k, v in self.as_dict().items()))
+
+    @property
+    def quantiles(self):
+        # {p: estimate}
+        return {q.p: q.value for q in self.estimators}
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self.variance)
+
+    @property
+    def variance(self):
+        # the sample variance, or None if there are fewer than two values
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def add(self, x):
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.min = self.max = x
+        else:
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+            if x < self.min:
+                self.min = x
+            elif x > self.max:
+                self.max = x
+
+        for estimator in self.estimators:
+            estimator.add(x)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "variance": self.variance,
+            "min": self.min,
+            "max": self.max,
+            "quantiles": self.quantiles,
+        }
+
+
+class StreamStats:
+
+    def __init__(self,
+                 keys,
+                 quantiles=QUANTILES,
+                 bucket=None,
+                 time_of=None,
+                 units_per_second=1000,
+                 separator="/",
+                 on_bucket=None,
+                 keep_buckets=True):
+        # time_of(message) returns the time in a message, raising KeyError
+        # if there isn't one; it is only needed with bucket
+
+        if bucket is not None and time_of is None:
+            raise ValueError("time_of is needed to use buckets")
+
+        if not keep_buckets and on_bucket is None:
+            raise ValueError("on_bucket is needed if buckets are not kept")
+
+        self.bucket = bucket
+        self.buckets = {}  # bucket start: {key: Summary}
+        self.current = None  # start of the latest bucket
+        self.keep_buckets = keep_buckets
+        self.keys = list(keys)
+        self.messages = 0
+        self.on_bucket = on_bucket
+        self.paths = [compile_key(key, separator) for key in self.keys]
+        self.quantiles = quantiles
+        self.summaries = {key: Summary(quantiles) for key in self.keys}
+        self.time_of = time_of
+        self.units_per_second = units_per_second
+
+    def __repr__(self):
+        return "StreamStats(%d messages, %s)" % (self.messages,
+                                                 self.summaries)
+
+    def add(self, message):
+        self.messages += 1
+
+        summaries = [self.summaries]
+        if self.bucket is not None:
+            in_bucket = self.bucket_for(message)
+            if in_bucket is not None:
+                summaries.append(in_bucket)
+
+        for key, path in zip(self.keys, self.paths):
+            try:
+                v = lookup(message, path)
+            except KeyError:
+                continue
+            for x in (v if is_sequence(v) else (v, )):
+                # bool is an int, but not a measurement
+                if isinstance(x, (int, float)) and not isinstance(x, bool):
+                    for s in summaries:
+                        s[key].add(x)
+
+    def bucket_for(self, message):
+        # the summaries for the bucket containing message, or None
+        try:
+            t = self.time_of(message)
+        except KeyError:
+            return None
+
+        width = self.bucket * self.units_per_second
+        start = math.floor(t / width) * width
+
+        if start not in self.buckets:
+            self.finish()
+            self.buckets[start] = {
+                key: Summary(self.quantiles)
+                for key in self.keys
+            }
+            self.current = start
+
+        return self.buckets[start]
+
+    def finish(self):
+        # pass the latest bucket to on_bucket, e.g. at the end of a run
+        if self.current is None:
+            return
+        if self.on_bucket is not None:
+            self.on_bucket(self.current, self.buckets[self.current])
+        if not self.keep_buckets:
+            del self.buckets[self.current]
+        self.current = None
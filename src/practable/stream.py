@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MessageStream wraps an iterator of messages, so that processing steps can be
+chained without keeping the messages in memory, e.g.
+
+    positions = (expt.stream(duration=3600)
+                 .filter(lambda m: "d" in m)
+                 .decimate(10)
+                 .map(lambda m: m["d"]))
+
+    for d in positions:
+        ...
+
+Nothing is received until the stream is iterated over. Each step returns a
+new MessageStream, and a stream can only be iterated over once.
+
+"""
+import itertools
+
+
+class MessageStream:
+
+    def __init__(self, messages):
+        self.messages = iter(messages)
+
+    def __iter__(self):
+        return self.messages
+
+    def __next__(self):
+        return next(self.messages)
+
+    def collect(self):
+        # keep all the remaining messages in a list
+        return list(self.messages)
+
+    def decimate(self, n):
+        # keep only every nth message, starting with the first
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        return MessageStream(itertools.islice(self.messages, 0, None, n))
+
+    def each(self, fn):
+        # call fn with each message, e.g. to log or plot it, and pass it on
+        return MessageStream(_each(self.messages, fn))
+
+    def filter(self, fn):
+        # keep only the messages for which fn(message) is True
+        return MessageStream(filter(fn, self.messages))
+
+    def map(self, fn):
+        # replace each message with fn(message)
+        return MessageStream(map(fn, self.messages))
+
+    def take(self, n):
+        # stop after n messages
+        return MessageStream(itertools.islice(self.messages, n))
+
+
+def _each(messages, fn):
+    for message in messages:
+        fn(message)
+        yield message
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracer times each phase of starting an Experiment, and each request to the
+booking server within it, e.g.
+
+    tracer = Tracer()
+    with Experiment('g-open-x3fca8', 'Spinner 51 (Open Days)',
+                    tracer=tracer) as expt:
+        ...
+    print(tracer.report())
+
+    enter                                                     2.131s
+      add_group                                               0.120s
+        POST /book/api/v1/users/{}/groups/{}                  0.119s status=204
+      get_group_details                                       0.002s
+      get_bookings                                            0.091s
+      ...
+
+Requests are recorded with their status, the number of retries, and the
+number of bytes sent and received.
+
+Spans nest within whichever span is open on the same thread, so a Tracer
+can be shared by experiments started in parallel (e.g. a Fleet). Work
+handed to other threads (e.g. checking slots concurrently) is wrapped with
+carry(tracer, fn), so that its spans nest within the span that was open
+when it was handed over. hook(span) is called as each span finishes.
+
+To send the spans to OpenTelemetry as well, pass a tracer from
+opentelemetry.trace.get_tracer(), or opentelemetry=True to get one named
+"practable" (this needs the opentelemetry-api package).
+
+"""
+import contextlib
+import threading
+import time
+
+
+class Span:
+
+    def __init__(self, name, attributes, parent=None):
+        self.attributes = dict(attributes)
+        self.children = []
+        self.end = None
+        self.name = name
+        self.otel = None  # the OpenTelemetry span, if there is one
+        self.parent = parent
+        self.start = time.perf_counter()
+
+    @property
+    def duration(self):
+        # in seconds, or None if the span hasn't finished
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def set(self, key, value):
+        self.attributes[key] = value
+        if self.otel is not None:
+            self.otel.set_attribute(key, value)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "children": [child.as_dict() for child in self.children],
+        }
+
+
+class Tracer:
+
+    def __init__(self, hook=None, opentelemetry=None):
+
+        if opentelemetry is True:
+            from opentelemetry import trace
+            opentelemetry = trace.get_tracer("practable")
+
+        self.hook = hook
+        self.local = threading.local()  # the open span on each thread
+        self.lock = threading.Lock()
+        self.opentelemetry = opentelemetry
+        self.spans = []  # top level spans
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def report(self):
+        # the finished spans, as an indented table of durations
+        lines = []
+
+        def add(span, depth):
+            if span.duration is None:
+                return
+            name = "  " * depth + span.name
+            attributes = " ".join("%s=%s" % (k, v)
+                                  for k, v in span.attributes.items())
+            lines.append(("%-60s %8.3fs %s" %
+                          (name, span.duration, attributes)).rstrip())
+            for child in span.children:
+                add(child, depth + 1)
+
+        with self.lock:
+            for span in self.spans:
+                add(span, 0)
+
+        return "\n".join(lines)
+
+    def current(self):
+        # the span open on this thread, or None
+        return getattr(self.local, "span", None)
+
+    @contextlib.contextmanager
+    def span(self, name, parent=None, **attributes):
+        # parent is the span to nest within, if not the one open on this
+        # thread, e.g. for work done on another thread
+        previous = self.current()
+        if parent is None:
+            parent = previous
+        span = Span(name, attributes, parent)
+
+        with self.lock:
+            if parent is None:
+                self.spans.append(span)
+            else:
+                parent.children.append(span)
+
+        otel = contextlib.nullcontext()
+        if self.opentelemetry is not None:
+            context = None
+            if parent is not None and parent.otel is not None:
+                # OpenTelemetry's context doesn't follow us across threads
+                from opentelemetry import trace
+                context = trace.set_span_in_context(parent.otel)
+            otel = self.opentelemetry.start_as_current_span(
+                name, context=context, attributes=attributes)
+
+        self.local.span = span
+        try:
+            with otel as span.otel:
+                yield span
+        except BaseException as e:
+            span.set("error", type(e).__name__)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            self.local.span = previous
+            if self.hook is not None:
+                self.hook(span)
+
+
+def carry(tracer, fn):
+    # fn, wrapped so that spans it makes on another thread nest within the
+    # span open on this one, e.g. executor.submit(carry(tracer, fn), ...)
+    if tracer is None:
+        return fn
+    parent = tracer.current()
+
+    def call(*args, **kwargs):
+        previous = tracer.current()
+        tracer.local.span = parent
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            tracer.local.span = previous
+
+    return call
+
+
+def span(tracer, name, **attributes):
+    # a span from tracer, or one that does nothing if tracer is None
+    if tracer is None:
+        return contextlib.nullcontext(NoSpan())
+    return tracer.span(name, **attributes)
+
+
+class NoSpan:
+    # stands in for a Span when there is no Tracer
+
+    def set(self, key, value):
+        pass
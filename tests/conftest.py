@@ -0,0 +1,29 @@
+# fixtures and helpers for the tests that run against the local Emulator
+from datetime import datetime, timezone
+
+import pytest
+
+from practable.core import Experiment
+from practable.emulator import Emulator, Telemetry
+
+
+@pytest.fixture
+def emu(tmp_path, monkeypatch):
+    # config_in_cwd=True keeps the login and cache files in tmp_path
+    monkeypatch.chdir(tmp_path)
+    with Emulator(experiments=3,
+                  telemetry=Telemetry(rate=200, lines_per_frame=2)) as emu:
+        yield emu
+
+
+def current_bookings(emu):
+    now = datetime.now(timezone.utc)
+    return [b for b in emu.bookings.values() if b["start"] <= now <= b["end"]]
+
+
+def experiment(emu, name="Spinner 1", **kwargs):
+    return Experiment(emu.group,
+                      name,
+                      book_server=emu.book_server,
+                      config_in_cwd=True,
+                      **kwargs)
@@ -0,0 +1,73 @@
+import asyncio
+
+from conftest import current_bookings
+from practable.aio import AsyncExperiment
+from practable.core import Booker
+
+
+def async_experiment(emu, name="Spinner 1", **kwargs):
+    return AsyncExperiment(emu.group,
+                           name,
+                           book_server=emu.book_server,
+                           config_in_cwd=True,
+                           **kwargs)
+
+
+def test_collect_and_command(emu, monkeypatch):
+    closed = []
+    close = Booker.close
+    monkeypatch.setattr(Booker, "close",
+                        lambda booker: closed.append(booker) or close(booker))
+
+    async def run():
+        async with async_experiment(emu) as expt:
+            await expt.command('{"set":"mode","to":"position"}')
+            await expt.command('{"set":"position","to":2}')
+            messages = await expt.collect(0.5)
+            assert len(current_bookings(emu)) == 1
+            return messages
+
+    messages = asyncio.run(run())
+    t = [m["t"] for m in messages]
+    assert len(t) > 50
+    assert t == sorted(t)
+    assert t[-1] - t[0] >= 500
+    assert messages[-1]["c"] == 2
+
+    # the booking we made is cancelled, and the booker closed, on exit
+    assert current_bookings(emu) == []
+    assert len(closed) == 1
+
+
+def test_many_experiments(emu):
+
+    async def run(name):
+        async with async_experiment(emu, name, exact=True) as expt:
+            messages = await expt.collect_count(20)
+            first = await expt.__anext__()
+            return messages, first
+
+    async def main():
+        names = ["Spinner 1", "Spinner 2", "Spinner 3"]
+        return await asyncio.gather(*[run(name) for name in names])
+
+    for messages, first in asyncio.run(main()):
+        assert len(messages) == 20
+        assert first["t"] >= messages[-1]["t"]
+    assert current_bookings(emu) == []
+
+
+def test_collect_stops_on_local_clock(emu):
+
+    async def run():
+        async with async_experiment(emu) as expt:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            ignored = await expt.ignore(0.2, stop_on="local")
+            messages = await expt.collect(0.2, stop_on="local")
+            return ignored, messages, loop.time() - started
+
+    ignored, messages, elapsed = asyncio.run(run())
+    assert ignored == []
+    assert len(messages) > 0
+    assert 0.4 <= elapsed < 1
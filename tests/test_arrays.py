@@ -0,0 +1,103 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from practable.aio import AsyncExperiment
+from practable.core import Experiment
+
+MESSAGES = [
+    {
+        "t": 1,
+        "d": 10,
+        "data": {
+            "v": [1, 2]
+        }
+    },
+    {
+        "t": 2,
+        "data": {
+            "v": [3, 4, 5]
+        }
+    },
+    {
+        "t": 3,
+        "d": 30,
+        "data": {
+            "v": [6, 7]
+        }
+    },
+]
+
+
+@pytest.fixture(params=["Experiment", "AsyncExperiment"])
+def to_arrays(request):
+    # to_arrays only needs key_separator, so neither experiment has to be
+    # booked or connected; AsyncExperiment books nothing until it is entered
+    expt = AsyncExperiment("g", "Spinner 1")
+    if request.param == "Experiment":
+        return lambda *args, **kwargs: Experiment.to_arrays(
+            expt, *args, **kwargs)
+    return expt.to_arrays
+
+
+def test_missing_skip(to_arrays):
+    a = to_arrays(MESSAGES, ["t", "d"])
+    assert a["t"].tolist() == [1, 2, 3]
+    assert a["d"].tolist() == [10, 30]
+
+
+def test_missing_nan(to_arrays):
+    a = to_arrays(MESSAGES, ["t", "d"], missing="nan")
+    assert a["t"].tolist() == [1, 2, 3]
+    assert a["d"][0] == 10 and math.isnan(a["d"][1]) and a["d"][2] == 30
+
+
+def test_missing_raise(to_arrays):
+    with pytest.raises(KeyError):
+        to_arrays(MESSAGES, ["t", "d"], missing="raise")
+
+
+def test_ragged_allow(to_arrays):
+    a = to_arrays(MESSAGES, ["t", "data/v"])
+    assert a["t"].tolist() == [1, 2, 3]
+    assert a["data/v"].tolist() == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_ragged_truncate(to_arrays):
+    a = to_arrays(MESSAGES, ["t", "data/v"], ragged="truncate")
+    assert a["t"].tolist() == [1, 2, 3]
+    assert a["data/v"].tolist() == [1, 3, 6]
+
+
+def test_ragged_raise(to_arrays):
+    with pytest.raises(ValueError):
+        to_arrays(MESSAGES, ["t", "data/v"], ragged="raise")
+
+
+def test_missing_nan_with_lists(to_arrays):
+    # a message without d adds a NaN for each of its values of data/v
+    a = to_arrays(MESSAGES, ["d", "data/v"], missing="nan", ragged="truncate")
+    assert a["data/v"].tolist() == [1, 3, 4, 5, 6]
+    assert np.isnan(a["d"]).tolist() == [False, True, True, True, False]
+
+
+def test_structured(to_arrays):
+    sa = to_arrays(MESSAGES, ["t", "d"], missing="nan", structured=True)
+    assert sa.dtype.names == ("t", "d")
+    assert sa["t"].tolist() == [1, 2, 3]
+    assert sa["d"][2] == 30
+
+    sa = to_arrays(MESSAGES, ["t"], structured=True)
+    assert sa["t"].tolist() == [1, 2, 3]
+
+    with pytest.raises(ValueError):
+        to_arrays(MESSAGES, ["t", "d"], structured=True)
+
+
+def test_bad_policies(to_arrays):
+    with pytest.raises(ValueError):
+        to_arrays(MESSAGES, ["t"], missing="zero")
+    with pytest.raises(ValueError):
+        to_arrays(MESSAGES, ["t"], ragged="pad")
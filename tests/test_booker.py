@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta, timezone
+import os
+import stat
+
+import pytest
+
+from conftest import experiment
+from practable.core import Booker
+from practable.emulator import Emulator
+from practable.metrics import Metrics
+
+
+def booker(emu, **kwargs):
+    b = Booker(book_server=emu.book_server, config_in_cwd=True, **kwargs)
+    b.add_group(emu.group)
+    return b
+
+
+def group_requests(metrics):
+    # the status of each request for group details
+    statuses = []
+    for c in metrics.as_dict()["counters"].get("http_requests_total", []):
+        labels = c["labels"]
+        if labels["method"] == "GET" and labels["endpoint"].endswith(
+                "/groups/{}"):
+            statuses.extend([labels["status"]] * c["value"])
+    return sorted(statuses)
+
+
+def test_token_is_reused(emu):
+    first = booker(emu)
+    second = booker(emu)
+    assert len(emu.tokens) == 1
+    assert first.headers == second.headers
+
+    path = first.token_path()
+    assert os.path.dirname(path) == os.getcwd()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    first.close()
+    second.close()
+
+
+def test_token_per_booking_server(emu):
+    # both servers' files are kept in the same directory
+    with Emulator(experiments=1) as other:
+        first = booker(emu)
+        second = booker(other)
+        assert first.token_path() != second.token_path()
+        assert len(emu.tokens) == 1 and len(other.tokens) == 1
+
+        # each still reuses its own token
+        booker(emu).close()
+        booker(other).close()
+        assert len(emu.tokens) == 1 and len(other.tokens) == 1
+        first.close()
+        second.close()
+
+
+def test_login_again_when_token_rejected(emu):
+    b = booker(emu)
+    b.get_group_details()
+    old = b.headers["Authorization"]
+
+    # e.g. the booking server restarted
+    emu.tokens.clear()
+    b.get_bookings()
+    assert b.headers["Authorization"] != old
+    assert list(emu.tokens) == [b.headers["Authorization"]]
+
+    # including for requests with headers of their own
+    emu.tokens.clear()
+    b.get_group_details(refresh=True)
+    assert list(emu.tokens) == [b.headers["Authorization"]]
+
+    # and other processes use the new token
+    assert booker(emu).headers == b.headers
+    b.close()
+
+
+def test_group_details_are_cached(emu):
+    m = Metrics()
+    b = booker(emu, metrics=m)
+    b.get_group_details()
+    assert group_requests(m) == ["200"]
+    assert sorted(b.experiment_details) == [
+        "Spinner 1", "Spinner 2", "Spinner 3"
+    ]
+
+    # another Booker uses the cache while it is fresh
+    m = Metrics()
+    other = booker(emu, metrics=m)
+    other.get_group_details()
+    assert group_requests(m) == []
+    assert other.experiment_details == b.experiment_details
+
+    # and revalidates it once it is stale
+    m = Metrics()
+    stale = booker(emu, metrics=m, cache_ttl=timedelta(0))
+    stale.get_group_details()
+    assert group_requests(m) == ["304"]
+    assert stale.experiment_details == b.experiment_details
+
+    m = Metrics()
+    fresh = booker(emu, metrics=m)
+    fresh.get_group_details(refresh=True)
+    assert group_requests(m) == ["200"]
+
+    for x in (b, other, stale, fresh):
+        x.close()
+
+
+def test_group_cache_per_booking_server(emu):
+    # a group of the same name on another server, with other experiments
+    with Emulator(experiments=1, group=emu.group) as other:
+        first = booker(emu)
+        first.get_group_details()
+        second = booker(other)
+        second.get_group_details()
+        assert len(first.experiment_details) == 3
+        assert len(second.experiment_details) == 1
+        first.close()
+        second.close()
+
+
+def test_book_soonest(emu, tmp_path, monkeypatch):
+    # another user has booked every experiment, for different lengths
+    other = booker(emu)
+    other.set_user("someone-else")
+    other.get_group_details()
+    # (a slot free within a second counts as available now)
+    for name, seconds in (("Spinner 1", 3), ("Spinner 2", 2), ("Spinner 3",
+                                                                 5)):
+        other.book(timedelta(seconds=seconds), selected=name)
+
+    (tmp_path / "mine").mkdir()
+    monkeypatch.chdir(tmp_path / "mine")
+    b = booker(emu)
+    b.get_group_details()
+    b.filter_experiments("Spinner")
+    assert b.available == []
+    assert len(b.unavailable) == 3
+
+    with pytest.raises(Exception):
+        b.book_soonest(timedelta(seconds=1), max_wait=timedelta(seconds=0.5))
+
+    before = datetime.now(timezone.utc)
+    name, start = b.book_soonest(timedelta(seconds=1),
+                                 max_wait=timedelta(seconds=10))
+    assert name == "Spinner 2"
+    assert start > before
+
+    # Experiment(queue=True) waits for the soonest free experiment, which
+    # is Spinner 1, or Spinner 2 after our booking of it
+    with experiment(emu, "Spinner", queue=True) as expt:
+        assert expt.name in ("Spinner 1", "Spinner 2")
+        assert datetime.now(timezone.utc) >= before + timedelta(seconds=2)
+        assert len(expt.collect(0.1, verbose=False)) > 0
+    other.close()
+    b.close()
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from practable.buffer import MessageBuffer
+
+
+def test_drop_oldest():
+    b = MessageBuffer(capacity=3)
+    for i in range(5):
+        assert b.put(i)
+    assert [b.popleft() for i in range(3)] == [2, 3, 4]
+    assert b.dropped_oldest == 2
+    assert b.dropped == 2
+
+
+def test_drop_newest():
+    b = MessageBuffer(capacity=3, overflow="drop-newest")
+    added = [b.put(i) for i in range(5)]
+    assert added == [True, True, True, False, False]
+    assert [b.popleft() for i in range(3)] == [0, 1, 2]
+    assert b.dropped_newest == 2
+
+
+def test_block_without_waiting_raises():
+    b = MessageBuffer(capacity=2, overflow="block")
+    b.put(0)
+    b.put(1)
+    with pytest.raises(OverflowError):
+        b.put(2, block=False)
+
+
+def test_block_waits_for_room():
+    b = MessageBuffer(capacity=1, overflow="block")
+    b.put(0)
+    t = threading.Thread(target=b.put, args=(1, ))
+    t.start()
+    assert b.get(timeout=1) == 0
+    t.join(timeout=1)
+    assert b.get(timeout=1) == 1
+    assert b.dropped == 0
+
+
+def test_get_times_out_and_close_raises():
+    b = MessageBuffer()
+    with pytest.raises(TimeoutError):
+        b.get(timeout=0.01)
+    b.put(0)
+    b.close(ValueError("done"))
+    assert b.get(timeout=0) == 0
+    with pytest.raises(ValueError):
+        b.get(timeout=0)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        MessageBuffer(capacity=0)
+    with pytest.raises(ValueError):
+        MessageBuffer(overflow="drop-everything")
@@ -0,0 +1,42 @@
+from practable.catalogue import Catalogue
+
+
+def catalogue():
+    c = Catalogue()
+    c.add_group("g-a", {
+        "Spinner 51 (Open Days)": {"slot": "s51"},
+        "Spinner 7": {"slot": "s7"},
+        "Pendulum 51": {"slot": "p51"},
+    })
+    c.add_group("g-b", {
+        "Spinner 7": {"slot": "s7"},
+        "Truss 3": {"slot": "t3"},
+    })
+    return c
+
+
+def test_find():
+    c = catalogue()
+    assert len(c) == 4
+    assert c.find(substring="Spinner") == [
+        "Spinner 51 (Open Days)", "Spinner 7"
+    ]
+    assert c.find(exact="Spinner 7") == ["Spinner 7"]
+    assert c.find(exact="Spinner") == []
+    assert c.find(prefix="Spinner 5") == ["Spinner 51 (Open Days)"]
+    assert c.find(number=51) == ["Pendulum 51", "Spinner 51 (Open Days)"]
+    assert c.find(number=(1, 10)) == ["Spinner 7", "Truss 3"]
+    assert c.find(substring="Spinner", group="g-b") == ["Spinner 7"]
+    assert c.find(regex=r"^\w+ \d$") == ["Spinner 7", "Truss 3"]
+    assert c.find(substring="pin") == ["Spinner 51 (Open Days)", "Spinner 7"]
+    assert c.find(substring="x") == []
+
+
+def test_add_group_again_replaces_its_experiments():
+    c = catalogue()
+    c.add_group("g-b", {"Truss 4": {"slot": "t4"}})
+    # Spinner 7 is still in g-a
+    assert c.find(group="g-b") == ["Truss 4"]
+    assert "Spinner 7" in c
+    assert "Truss 3" not in c
+    assert c.find(number=3) == []
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from conftest import experiment
+from practable.command import Acknowledgement, CommandQueue, RateLimiter
+
+
+def test_rate_limiter_spaces_commands():
+    limiter = RateLimiter(rate=50, burst=2)
+    # the burst can be sent at once, then each waits its turn
+    assert [limiter.reserve() for i in range(2)] == [0, 0]
+    waits = [limiter.reserve() for i in range(3)]
+    assert waits[0] == pytest.approx(0.02, abs=0.005)
+    assert waits[1] == pytest.approx(0.04, abs=0.005)
+    assert waits[2] == pytest.approx(0.06, abs=0.005)
+
+
+def test_rate_limiter_counts_time_already_spent():
+    limiter = RateLimiter(rate=20)
+    limiter.acquire()
+    time.sleep(0.05)
+    assert limiter.reserve() == 0
+
+
+def test_rate_limiter_arguments():
+    assert RateLimiter(rate=None).reserve() == 0
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+    with pytest.raises(ValueError):
+        RateLimiter(burst=0)
+
+
+def test_acknowledgement():
+    ack = Acknowledgement(lambda m: m["c"] == 2)
+    assert not ack.check({"d": 1})  # no "c" is not a match
+    assert not ack.check({"c": 1})
+    assert not ack.wait(0.01)
+    assert ack.check({"c": 2, "t": 5})
+    assert ack.is_set() and ack.wait(0)
+    assert ack.message == {"c": 2, "t": 5}
+
+
+def test_command_queue_sends_in_order():
+    sent = []
+    release = threading.Event()
+
+    def send(message, ack, timeout):
+        release.wait()
+        sent.append(message)
+
+    q = CommandQueue(send)
+    for i in range(5):
+        q.put(i)
+    assert sent == []  # put() doesn't wait for them to be sent
+    release.set()
+    q.join()
+    assert sent == [0, 1, 2, 3, 4]
+    q.close()
+    with pytest.raises(RuntimeError):
+        q.put(5)
+
+
+def test_command_queue_stops_after_an_error():
+    sent = []
+
+    def send(message, ack, timeout):
+        if message == "bad":
+            raise ValueError(message)
+        sent.append(message)
+
+    q = CommandQueue(send)
+    for message in ("a", "bad", "b"):
+        q.put(message)
+    with pytest.raises(ValueError):
+        q.join()
+    assert sent == ["a"]
+    q.close()
+
+
+def test_commands_with_ack(emu):
+    with experiment(emu) as expt:
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.command('{"set":"position","to":2}', verbose=False, ack={"c": 2})
+        # the messages read while waiting for it are kept, so the new set
+        # point shows up after those
+        assert expt.collect(0.1, verbose=False)[-1]["c"] == 2
+
+        # a function can match the acknowledgement too
+        expt.command('{"set":"position","to":3}',
+                     verbose=False,
+                     ack=lambda m: m["c"] == 3)
+
+        # an acknowledgement that never comes times out
+        with pytest.raises(TimeoutError):
+            expt.command('{"set":"position","to":4}',
+                         verbose=False,
+                         ack={"c": 5},
+                         timeout=0.2)
+
+
+def test_commands_in_the_background(emu):
+    with experiment(emu, background=True) as expt:
+        started = time.monotonic()
+        expt.commands(
+            ['{"set":"mode","to":"position"}', '{"set":"position","to":2}'],
+            verbose=False,
+            block=False,
+            ack={"c": 2})
+        assert time.monotonic() - started < 0.05
+        expt.flush_commands()
+        assert expt.collect(0.1, verbose=False)[-1]["c"] == 2
@@ -0,0 +1,73 @@
+import math
+
+import pytest
+
+from practable.decimate import LTTB, BucketMean, Envelope, Every, make_decimator
+
+
+def time_of(message):
+    return message["t"]
+
+
+def run(decimator, messages):
+    decimator = make_decimator(decimator)
+    decimator.start(time_of, time_path=("t", ))
+    return list(decimator.run(messages))
+
+
+def test_lttb_keeps_first_last_and_peaks():
+    messages = [{"t": t, "d": math.sin(t / 10)} for t in range(200)]
+    messages[101]["d"] = 10  # a spike
+    kept = run(LTTB(10, "d"), messages)
+    assert kept[0] is messages[0]
+    assert kept[-1] is messages[-1]
+    assert messages[101] in kept
+    assert len(kept) <= 200 // 10 + 2
+    assert [m["t"] for m in kept] == sorted(m["t"] for m in kept)
+
+
+def test_lttb_fewer_messages_than_bucket():
+    # the first and last are kept, and one from the part-bucket between them
+    messages = [{"t": t, "d": t} for t in range(4)]
+    assert len(run(LTTB(10, "d"), messages)) == 3
+    assert run(LTTB(10, "d"), messages[:1]) == messages[:1]
+
+
+def test_lttb_skips_messages_without_numbers():
+    messages = [{"t": 0, "d": 1}, {"t": 1}, {"t": 2, "d": "x"}]
+    assert run(LTTB(1, "d"), messages) == [messages[0]]
+
+
+def test_every():
+    assert run(5, [{"t": t} for t in range(12)]) == [{"t": 0}, {"t": 5},
+                                                      {"t": 10}]
+    with pytest.raises(ValueError):
+        Every(0)
+
+
+def test_shared_decimator_is_not_changed():
+    e = Every(2)
+    run(e, [{"t": t} for t in range(3)])
+    assert not hasattr(e, "count")
+
+
+def test_bucket_mean_nested():
+    messages = [{"data": {"t": t, "d": [t, t + 1]}} for t in range(20)]
+    decimator = make_decimator(BucketMean(0.01))
+    decimator.start(lambda m: m["data"]["t"], time_path=("data", "t"))
+    assert list(decimator.run(messages)) == [{
+        "data": {
+            "t": 4.5,
+            "d": 5.0
+        }
+    }, {
+        "data": {
+            "t": 14.5,
+            "d": 15.0
+        }
+    }]
+
+
+def test_envelope():
+    messages = [{"t": t, "d": v} for t, v in enumerate([3, 9, 1, 5])]
+    assert run(Envelope(1, "d"), messages) == [messages[1], messages[2]]
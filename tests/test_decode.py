@@ -0,0 +1,90 @@
+import pytest
+
+from conftest import experiment
+from practable.aio import AsyncExperiment
+from practable.decode import Decoder, msgspec, orjson
+
+BACKENDS = [
+    "json",
+    pytest.param("orjson",
+                 marks=pytest.mark.skipif(orjson is None,
+                                          reason="needs orjson")),
+    pytest.param("msgspec",
+                 marks=pytest.mark.skipif(msgspec is None,
+                                          reason="needs msgspec")),
+]
+
+
+def counting(decoder):
+    # count the calls made to decode a single value or line
+    calls = []
+    loads = decoder.loads
+
+    def counted(s):
+        calls.append(s)
+        return loads(s)
+
+    decoder.loads = counted
+    return calls
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decode(backend):
+    d = Decoder(backend)
+    assert d.backend == backend
+    assert d.decode('{"t":1}\n\n{"t":2}\n') == [{"t": 1}, {"t": 2}]
+    assert d.decode(b'{"t":3}') == [{"t": 3}]
+    assert d.decode("") == []
+    assert d.decode("\n \n") == []
+    assert d.errors == 0
+
+
+def test_frame_decoded_in_one_call():
+    d = Decoder("json")
+    calls = counting(d)
+    assert d.decode("\n".join('{"t":%d}' % i for i in range(10))) == [{
+        "t": i
+    } for i in range(10)]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_falls_back_to_lines(backend):
+    d = Decoder(backend)
+    objs = d.decode('{"t":1}\n{"t":\n{"t":3}')
+    assert objs == [{"t": 1}, {"t": 3}]
+    assert d.errors == 1
+    assert d.last_error == '{"t":'
+
+    # a line with more than one value decodes as an array of the wrong
+    # length, which is also caught by going line by line
+    objs = d.decode('{"t":4}\n5,6')
+    assert objs == [{"t": 4}]
+    assert d.errors == 2
+    assert d.last_error == "5,6"
+
+
+def test_errors_are_counted_not_printed(capsys):
+    d = Decoder("json")
+    for i in range(3):
+        assert d.decode("not json") == []
+    assert d.errors == 3
+    assert capsys.readouterr().out == ""
+    assert str(d) == "json decoder (3 errors)"
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Decoder("yaml")
+
+
+def test_experiment_decoder(emu):
+    d = Decoder("json")
+    with experiment(emu, decoder=d) as expt:
+        assert expt.decoder is d
+        assert expt.decode('{"t":1}\nnot json') == [{"t": 1}]
+        assert d.errors == 1
+
+    expt = AsyncExperiment("g", "Spinner 1", decoder="json")
+    assert expt.decoder.backend == "json"
+    assert expt.decode('{"t":1}\n{"t":2}') == [{"t": 1}, {"t": 2}]
@@ -0,0 +1,96 @@
+# smoke tests of Experiment and Fleet against the local Emulator
+from datetime import timedelta
+import threading
+
+import pytest
+
+from conftest import current_bookings, experiment
+from practable.core import Booker
+from practable.fleet import Fleet
+from practable.metrics import Metrics
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_experiment_collects_and_commands(emu, background):
+    with experiment(emu, background=background) as expt:
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.command('{"set":"position","to":2}',
+                     verbose=False,
+                     ack={"c": 2})
+        messages = expt.collect(0.5, verbose=False)
+        assert len(messages) > 50
+        assert messages[-1]["c"] == 2
+        t = expt.extract_series(messages, "t")
+        assert t == sorted(t)
+        assert len(current_bookings(emu)) == 1
+
+    # the booking we made is cancelled on exit
+    assert current_bookings(emu) == []
+
+
+def test_fleet(emu):
+    with Fleet(emu.group,
+               "Spinner",
+               book_server=emu.book_server,
+               config_in_cwd=True,
+               workers=4,
+               verbose=False) as fleet:
+        assert len(fleet) == 3
+        # a pooled connection to the booking server for each worker
+        adapter = fleet.booker.session.get_adapter(emu.book_server)
+        assert adapter._pool_maxsize == 4
+        results = fleet.run(lambda expt: len(expt.collect(0.2, verbose=False)))
+        assert sorted(results) == ["Spinner 1", "Spinner 2", "Spinner 3"]
+        assert all(n > 0 for n in results.values())
+    assert current_bookings(emu) == []
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_reconnect(emu, background):
+    gaps = []
+    with experiment(emu, background=background,
+                    on_gap=gaps.append) as expt:
+        threading.Timer(0.3, emu.disconnect).start()
+        messages = expt.collect(1, verbose=False)
+        t = expt.extract_series(messages, "t")
+        assert t[-1] - t[0] >= 990
+        assert len(gaps) == 1
+        assert gaps == expt.gaps
+        assert gaps[0]["reconnects"] == 1
+        assert gaps[0]["start"] <= gaps[0]["end"]
+
+        # a command sent while disconnected is sent once reconnected
+        emu.disconnect()
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.command('{"set":"position","to":3}',
+                     verbose=False,
+                     ack={"c": 3})
+
+
+def test_no_reconnect(emu):
+    with experiment(emu, reconnect=False) as expt:
+        expt.collect(0.1, verbose=False)
+        threading.Timer(0.1, emu.disconnect).start()
+        with pytest.raises(Exception):
+            expt.collect(1, verbose=False)
+
+
+def test_only_the_experiments_activity_is_fetched(emu):
+    # hold bookings for the other experiments, whose activities should not
+    # be fetched when starting this one
+    booker = Booker(book_server=emu.book_server, config_in_cwd=True)
+    booker.add_group(emu.group)
+    booker.get_group_details()
+    for name in ("Spinner 2", "Spinner 3"):
+        booker.filter_experiments(name, exact=True)
+        booker.book(timedelta(minutes=1))
+
+    m = Metrics()
+    with experiment(emu, metrics=m) as expt:
+        assert list(expt.booker.activities) == ["Spinner 1"]
+    puts = [
+        c["value"] for c in m.as_dict()["counters"]["http_requests_total"]
+        if c["labels"]["method"] == "PUT"
+    ]
+    assert sum(puts) == 1
+    booker.close()
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from conftest import experiment
+from practable.history import History
+
+
+def history(retention=None):
+    return History(lambda m: m["t"], retention=retention)
+
+
+def times(messages):
+    return [m["t"] for m in messages]
+
+
+def test_window_and_last():
+    h = history()
+    h.add([{"t": t} for t in range(0, 5000, 100)])
+    assert len(h) == 50
+    assert h.latest() == 4900
+    assert times(h.window(1000, 1300)) == [1000, 1100, 1200]
+    assert times(h.window(end=200)) == [0, 100]
+    assert times(h.window(4800)) == [4800, 4900]
+    assert times(h.last(0.2)) == [4700, 4800, 4900]
+
+
+def test_out_of_order_and_untimed():
+    h = history()
+    h.add([{"t": 1}, {"t": 5}, {"t": 3}, {"d": 2}])
+    assert times(h.window()) == [1, 3, 5]
+    assert h.untimed == 1
+
+
+def test_retention():
+    h = history(retention=1)
+    for t in range(0, 5000, 10):
+        h.add([{"t": t}])
+    assert times(h.window())[0] == 3990
+    assert h.latest() == 4990
+    # evicted messages are dropped from the lists in batches
+    assert len(h.times) < 1000
+
+    h.clear()
+    assert len(h) == 0 and h.latest() is None and h.last(1) == []
+
+
+def test_marks():
+    h = history(retention=1)
+    with pytest.raises(KeyError):
+        h.since()
+    h.mark("before")  # before any messages, so since() returns them all
+    h.add([{"t": 0}, {"t": 100}])
+    h.mark("a")
+    h.add([{"t": 200}])
+    h.mark("b")
+    h.add([{"t": 300}])
+    assert times(h.since("before")) == [0, 100, 200, 300]
+    assert times(h.since("a")) == [200, 300]
+    assert times(h.since()) == [300]
+
+    # marks are evicted with the messages
+    h.add([{"t": 1150}])
+    with pytest.raises(KeyError):
+        h.since("a")
+    assert times(h.since("b")) == [300, 1150]
+
+
+def test_experiment_history(emu):
+    with experiment(emu, background=True, retention=1) as expt:
+        time.sleep(0.2)
+        command = '{"set":"position","to":2}'
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.command(command, verbose=False, ack={"c": 2})
+        time.sleep(0.1)
+
+        since = expt.since(command)
+        assert len(since) > 0
+        assert since[-1]["c"] == 2
+        last = expt.last(0.1)
+        assert 0 < last[-1]["t"] - last[0]["t"] <= 100
+        latest = expt.history.latest()
+        assert times(expt.window(latest - 50, latest + 1))[-1] == latest
+
+    with experiment(emu) as expt:
+        with pytest.raises(Exception, match="no history is kept"):
+            expt.last(1)
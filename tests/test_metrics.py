@@ -0,0 +1,78 @@
+import math
+
+from conftest import experiment
+from practable.metrics import Metrics
+
+
+def test_counters_with_mixed_label_types():
+    m = Metrics()
+    m.inc("http_requests_total", method="GET", endpoint="/x", status=200)
+    m.inc("http_requests_total", method="GET", endpoint="/x", status="error")
+    m.inc("http_requests_total", method="GET", endpoint="/x", status="200")
+
+    counters = m.as_dict()["counters"]["http_requests_total"]
+    assert sorted((c["labels"]["status"], c["value"]) for c in counters) == [
+        ("200", 2), ("error", 1)
+    ]
+    text = m.prometheus()
+    assert ('practable_http_requests_total{endpoint="/x",method="GET",'
+            'status="200"} 2') in text
+    assert ('practable_http_requests_total{endpoint="/x",method="GET",'
+            'status="error"} 1') in text
+
+
+def test_histogram():
+    m = Metrics(buckets=(0.1, 1))
+    for v in (0.05, 0.5, 5):
+        m.observe("decode_seconds", v, experiment="a")
+
+    h = m.as_dict()["histograms"]["decode_seconds"][0]
+    assert h["labels"] == {"experiment": "a"}
+    assert h["count"] == 3
+    assert h["min"] == 0.05 and h["max"] == 5
+    assert h["buckets"] == {0.1: 1, 1: 1, math.inf: 1}
+
+    lines = m.prometheus(prefix="").splitlines()
+    assert lines == [
+        "# TYPE decode_seconds histogram",
+        'decode_seconds_bucket{experiment="a",le="0.1"} 1',
+        'decode_seconds_bucket{experiment="a",le="1"} 2',
+        'decode_seconds_bucket{experiment="a",le="+Inf"} 3',
+        'decode_seconds_sum{experiment="a"} 5.55',
+        'decode_seconds_count{experiment="a"} 3',
+    ]
+
+
+def test_hook():
+    updates = []
+    m = Metrics(hook=lambda *args: updates.append(args))
+    m.inc("frames_total", experiment="a")
+    m.set("stash_depth", 3, experiment="a")
+    assert updates == [("counter", "frames_total", 1, {
+        "experiment": "a"
+    }), ("gauge", "stash_depth", 3, {
+        "experiment": "a"
+    })]
+
+
+def test_experiment_metrics(emu):
+    m = Metrics()
+    with experiment(emu, metrics=m) as expt:
+        expt.command('{"set":"mode","to":"position"}', verbose=False)
+        expt.collect(0.3, verbose=False)
+
+    d = m.as_dict()
+    assert d["counters"]["frames_total"][0]["value"] > 0
+    assert "time_key_lag_seconds" in d["histograms"]
+    assert "time_key_lag_current_seconds" in d["gauges"]
+    statuses = set(c["labels"]["status"]
+                   for c in d["counters"]["http_requests_total"])
+    assert "200" in statuses
+    assert all(isinstance(status, str) for status in statuses)
+
+    # each metric has exactly one type in the exposition format
+    types = [
+        line.split()[2] for line in m.prometheus().splitlines()
+        if line.startswith("# TYPE")
+    ]
+    assert len(types) == len(set(types))
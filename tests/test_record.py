@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import experiment
+from practable.core import ReplayExperiment
+from practable.decode import Decoder
+from practable.record import Recorder, Recording
+
+
+def record(path, frames, **kwargs):
+    with Recorder(path, **kwargs) as recorder:
+        for i, frame in enumerate(frames):
+            recorder.write(frame, received=float(i))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "run.log")
+    frames = ['{"t":%d}\n{"t":%d}' % (2 * i, 2 * i + 1) for i in range(100)]
+    # small chunks, so the frames are spread across several of them
+    record(path, frames, chunk_bytes=200)
+
+    with Recording(path) as recording:
+        assert len(recording.chunks) > 1
+        assert len(recording) == 100
+        assert list(recording.frames()) == [(float(i), frame)
+                                            for i, frame in enumerate(frames)]
+        t = [m["t"] for m in recording.messages(Decoder("json"))]
+        assert t == list(range(200))
+
+
+def test_replace_or_append(tmp_path):
+    path = str(tmp_path / "run.log")
+    record(path, ["a", "b"])
+    record(path, ["c"])
+    with Recording(path) as recording:
+        assert [frame for received, frame in recording.frames()] == ["c"]
+
+    record(path, ["d"], append=True)
+    with Recording(path) as recording:
+        assert [frame for received, frame in recording.frames()] == ["c", "d"]
+
+
+def test_incomplete_chunk_is_ignored(tmp_path):
+    path = tmp_path / "run.log"
+    record(str(path), ["a"])
+    record(str(path), ["b"], append=True)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    with Recording(str(path)) as recording:
+        assert [frame for received, frame in recording.frames()] == ["a"]
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "run.log"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        Recording(str(path))
+    path.write_bytes(b"not a recording")
+    with pytest.raises(ValueError):
+        Recording(str(path))
+
+
+def test_record_and_replay(emu, tmp_path):
+    path = str(tmp_path / "run.log")
+    with experiment(emu) as expt:
+        with pytest.raises(ValueError):
+            expt.record(str(tmp_path / "run.parquet"))
+        with pytest.raises(ValueError):
+            expt.record(str(tmp_path / "run.npz"))
+        expt.record(path)
+        recorded = expt.collect(0.3, verbose=False)
+        expt.stop_recording()
+
+    with ReplayExperiment(path) as expt:
+        replayed = expt.collect_count(len(recorded), verbose=False)
+    assert replayed == recorded
@@ -0,0 +1,107 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+import requests
+
+from practable.core import Booker
+from practable.metrics import Metrics
+
+
+class Scripted:
+    # an HTTP server that replies to each request with the next status in
+    # a list, or drops the connection without replying for "drop"
+
+    def __init__(self):
+        self.replies = []
+        self.methods = []
+        scripted = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def reply(self):
+                scripted.methods.append(self.command)
+                status = scripted.replies.pop(0)
+                if status == "drop":
+                    self.close_connection = True
+                    return
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                if status in (429, 503):
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+
+            do_GET = do_POST = do_PUT = do_DELETE = reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("localhost", 0), Handler)
+        self.url = "http://localhost:%d/api/v1/slots/sl-1" % (
+            self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever,
+                         kwargs={"poll_interval": 0.01},
+                         daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    s = Scripted()
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def booker(emu):
+    b = Booker(book_server=emu.book_server, config_in_cwd=True, backoff=0.001)
+    yield b
+    b.close()
+
+
+@pytest.mark.parametrize("method, replies, status, attempts", [
+    ("GET", [502, 200], 200, 2),
+    ("PUT", [504, 200], 200, 2),
+    ("GET", [429, 503, 200], 200, 3),
+    # the server may have acted on a POST that got a 502 or 504, so it is
+    # not repeated, unless the status says it was not processed
+    ("POST", [502, 204], 502, 1),
+    ("POST", [504, 204], 504, 1),
+    ("POST", [503, 204], 204, 2),
+    ("POST", [429, 204], 204, 2),
+    # gives up after retries
+    ("GET", [503] * 5, 503, 4),
+])
+def test_retry_status(booker, server, method, replies, status, attempts):
+    server.replies = replies
+    r = booker.request(method, server.url)
+    assert r.status_code == status
+    assert len(server.methods) == attempts
+
+
+def test_dropped_connection(booker, server):
+    # only repeated if it is safe to do so
+    server.replies = ["drop", 200]
+    assert booker.request("GET", server.url).status_code == 200
+    assert len(server.methods) == 2
+
+    server.methods.clear()
+    server.replies = ["drop", 204]
+    with pytest.raises(requests.ConnectionError):
+        booker.request("POST", server.url)
+    assert len(server.methods) == 1
+
+
+def test_retries_are_counted(booker, server):
+    booker.metrics = Metrics()
+    server.replies = [503, 502, 200]
+    booker.request("GET", server.url)
+    counters = booker.metrics.as_dict()["counters"]
+    assert counters["http_retries_total"][0]["value"] == 2
+    assert sorted(c["labels"]["status"]
+                  for c in counters["http_requests_total"]) == [
+                      "200", "502", "503"
+                  ]
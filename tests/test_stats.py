@@ -0,0 +1,61 @@
+import random
+import statistics
+
+import pytest
+
+from practable.stats import P2Quantile, StreamStats, Summary
+
+
+def test_p2_quantile_exact_for_few_values():
+    q = P2Quantile(0.5)
+    assert q.value is None
+    for x in (5, 1, 3):
+        q.add(x)
+    assert q.value == 3
+
+
+@pytest.mark.parametrize("p", [0.5, 0.9, 0.99])
+def test_p2_quantile_estimates(p):
+    rng = random.Random(1)
+    values = [rng.gauss(0, 1) for i in range(20000)]
+    q = P2Quantile(p)
+    for x in values:
+        q.add(x)
+    exact = sorted(values)[int(p * len(values))]
+    spread = max(values) - min(values)
+    assert abs(q.value - exact) < 0.02 * spread
+
+
+def test_p2_quantile_rejects_bad_p():
+    with pytest.raises(ValueError):
+        P2Quantile(1)
+
+
+def test_summary_matches_statistics():
+    rng = random.Random(2)
+    values = [rng.uniform(-5, 5) for i in range(1000)]
+    s = Summary()
+    for x in values:
+        s.add(x)
+    assert s.count == 1000
+    assert s.mean == pytest.approx(statistics.mean(values))
+    assert s.variance == pytest.approx(statistics.variance(values))
+    assert s.min == min(values)
+    assert s.max == max(values)
+
+
+def test_stream_stats_buckets():
+    reported = []
+    stats = StreamStats(["d"],
+                        bucket=0.01,
+                        time_of=lambda m: m["t"],
+                        on_bucket=lambda start, s: reported.append(
+                            (start, s["d"].count)),
+                        keep_buckets=False)
+    for t in range(35):
+        stats.add({"t": t, "d": [t, t]})
+    stats.add({"t": 35})  # no d
+    stats.finish()
+    assert reported == [(0, 20), (10, 20), (20, 20), (30, 10)]
+    assert stats.buckets == {}
+    assert stats.summaries["d"].count == 70
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import experiment
+from practable.fleet import Fleet
+from practable.trace import NoSpan, Tracer, carry, span
+
+
+def names(spans):
+    return [s.name for s in spans]
+
+
+def test_spans_nest():
+    finished = []
+    tracer = Tracer(hook=finished.append)
+    with tracer.span("outer", a=1) as outer:
+        with tracer.span("inner") as inner:
+            inner.set("b", 2)
+        assert tracer.current() is outer
+    assert tracer.current() is None
+
+    assert tracer.spans == [outer]
+    assert outer.children == [inner]
+    assert inner.attributes == {"b": 2}
+    assert 0 <= inner.duration <= outer.duration
+    assert finished == [inner, outer]
+    assert outer.as_dict()["children"][0]["name"] == "inner"
+
+    lines = tracer.report().splitlines()
+    assert lines[0].startswith("outer") and lines[0].endswith("a=1")
+    assert lines[1].startswith("  inner")
+
+    tracer.clear()
+    assert tracer.spans == [] and tracer.report() == ""
+
+
+def test_errors_are_recorded():
+    tracer = Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span("failing"):
+            raise ValueError()
+    assert tracer.spans[0].attributes == {"error": "ValueError"}
+    assert tracer.spans[0].duration is not None
+
+
+def test_carry_to_other_threads():
+    tracer = Tracer()
+
+    def work(i):
+        with tracer.span("work", i=i):
+            pass
+
+    with tracer.span("phase") as phase:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(carry(tracer, work), range(8)))
+
+    assert tracer.spans == [phase]
+    assert names(phase.children) == ["work"] * 8
+
+    # without carry, they would be spans of their own
+    assert carry(None, work) is work
+
+
+def test_no_tracer():
+    with span(None, "anything") as s:
+        assert isinstance(s, NoSpan)
+        s.set("key", "value")
+
+
+def test_experiment_phases(emu):
+    tracer = Tracer()
+    with experiment(emu, tracer=tracer):
+        pass
+
+    # the login (when the Booker is created) and cancelling the booking
+    # are outside it
+    enter, = [s for s in tracer.spans if s.name == "enter"]
+    assert enter.attributes["experiment"] == "Spinner 1"
+    phases = names(enter.children)
+    for phase in ("add_group", "get_group_details", "get_bookings", "book",
+                  "connect", "open"):
+        assert phase in phases
+    book = enter.children[phases.index("book")]
+    assert book.attributes["booked"] == "Spinner 1"
+    request, = book.children
+    assert request.name.startswith("POST ")
+    assert request.attributes["status"] == 204
+
+
+def test_fleet_phases(emu):
+    tracer = Tracer()
+    with Fleet(emu.group,
+               "Spinner",
+               book_server=emu.book_server,
+               config_in_cwd=True,
+               tracer=tracer,
+               verbose=False):
+        pass
+
+    enter, = [s for s in tracer.spans if s.name == "enter"]
+    assert enter.attributes["fleet"] == "Spinner"
+    phases = dict((s.name, s) for s in enter.children)
+
+    # the requests made on the worker threads nest within their phase
+    for phase in ("book", "open"):
+        children = phases[phase].children
+        assert len(children) == 3
+        assert all(s.name.startswith("POST ") for s in children)
+    assert phases["book"].attributes["booked"] == 3
+    assert len(phases["get_all_activities"].children) == 3